@@ -4,14 +4,56 @@ cloudinary_storage.py - Универсальное хранилище для ф
 """
 
 import os
+import re
 import logging
+import secrets
+import shutil
+import time
+from functools import lru_cache
+from itertools import count, islice
 from pathlib import Path
 from typing import List, Optional
 import hashlib
-from datetime import datetime
 
 logger = logging.getLogger(__name__)
 
+# Число попыток загрузки (между попытками пауза 2**attempt секунд)
+UPLOAD_ATTEMPTS = 3
+# Максимум public_id в одном запросе api.delete_resources
+DELETE_BATCH_SIZE = 100
+
+# Максимальный размер JPEG, который сохраняется локально без перекодирования
+COPY_AS_IS_MAX_BYTES = 500_000
+
+# Уникальные имена файлов: метка процесса + монотонный счетчик
+# (метка нужна, чтобы имена не повторялись после перезапуска)
+_PROCESS_TAG = secrets.token_hex(4)
+_filename_counter = count()
+
+# Параметры оптимизированного URL для отдачи на фронтенд
+OPTIMIZED_URL_OPTIONS = {
+    "width": 800,
+    "height": 600,
+    "crop": "fill",
+    "gravity": "auto",
+    "quality": "auto",
+    "fetch_format": "webp",  # Современный формат
+}
+# Заглушка public_id для шаблона URL (все public_id начинаются с avtorend/)
+_URL_PLACEHOLDER = "avtorend/__PUBLIC_ID__"
+
+# public_id вида avtorend/car_<id>/<имя> без расширения и query-параметров
+_PUBLIC_ID_RE = re.compile(r"(avtorend/.+?)(?:\.\w+)?(?:\?.*)?$")
+
+@lru_cache(maxsize=1)
+def _load_pyvips():
+    """pyvips (libvips) опционален: если не установлен, используем Pillow"""
+    try:
+        import pyvips
+        return pyvips
+    except (ImportError, OSError):
+        return None
+
 class CarPhotoStorage:
     """Класс для управления хранением фото автомобилей"""
     
@@ -23,6 +65,7 @@ class CarPhotoStorage:
                 import cloudinary
                 import cloudinary.uploader
                 import cloudinary.api
+                import cloudinary.exceptions
                 
                 cloudinary.config(
                     cloud_name=os.getenv('CLOUDINARY_CLOUD_NAME'),
@@ -31,12 +74,14 @@ class CarPhotoStorage:
                     secure=True
                 )
                 self.cloudinary = cloudinary
+                # Шаблон URL строим один раз: трансформации одинаковы для всех фото
+                self._url_tmpl = cloudinary.CloudinaryImage(_URL_PLACEHOLDER).build_url(**OPTIMIZED_URL_OPTIONS)
                 logger.info("✅ Cloudinary настроен")
             except ImportError:
                 logger.error("❌ Cloudinary не установлен. Используйте: pip install cloudinary")
                 self.use_cloudinary = False
             except Exception as e:
-                logger.error(f"❌ Ошибка настройки Cloudinary: {e}")
+                logger.error("❌ Ошибка настройки Cloudinary: %s", e)
                 self.use_cloudinary = False
         
         # Локальная директория для загрузки
@@ -59,9 +104,8 @@ class CarPhotoStorage:
         Returns:
             URL фото (Cloudinary или локальный)
         """
-        timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
         original_filename = Path(temp_file_path).name
-        filename_base = f"car_{car_id}_{timestamp}_{photo_index}"
+        filename_base = f"car_{car_id}_{_PROCESS_TAG}{next(_filename_counter):06d}_{photo_index}"
         
         if self.use_cloudinary:
             return self._save_to_cloudinary(temp_file_path, car_id, filename_base)
@@ -69,90 +113,147 @@ class CarPhotoStorage:
             return self._save_locally(temp_file_path, car_id, filename_base, original_filename)
     
     def _save_to_cloudinary(self, file_path: str, car_id: int, filename_base: str) -> str:
-        """Сохраняет фото в Cloudinary"""
+        """Сохраняет фото в Cloudinary; если загрузка не удалась — локально
+        
+        URL отдаем только после успешной загрузки.
+        """
+        # Создаем уникальный public_id
+        public_id = f"avtorend/car_{car_id}/{filename_base}"
+        
         try:
-            # Создаем уникальный public_id
-            public_id = f"avtorend/car_{car_id}/{filename_base}"
-            
-            # Загружаем в Cloudinary
-            result = self.cloudinary.uploader.upload(
-                file_path,
-                public_id=public_id,
-                folder=f"avtorend/car_{car_id}",
-                overwrite=False,
-                resource_type="image",
-                transformation=[
-                    {"width": 1200, "height": 800, "crop": "limit", "quality": "auto"},
-                    {"fetch_format": "auto"}
-                ]
-            )
-            
-            # Возвращаем оптимизированный URL
-            optimized_url = self.cloudinary.CloudinaryImage(public_id).build_url(
-                width=800,
-                height=600,
-                crop="fill",
-                gravity="auto",
-                quality="auto",
-                fetch_format="webp"  # Современный формат
-            )
-            
-            logger.info(f"✅ Фото загружено в Cloudinary: {public_id}")
-            return optimized_url
-            
+            self._upload_with_retry(file_path, public_id, f"avtorend/car_{car_id}")
         except Exception as e:
-            logger.error(f"❌ Ошибка загрузки в Cloudinary: {e}")
+            logger.error("❌ Ошибка загрузки в Cloudinary: %s", e)
             # Fallback: сохраняем локально
             return self._save_locally(file_path, car_id, filename_base, "cloudinary_fallback.jpg")
+        
+        logger.info("✅ Фото загружено в Cloudinary: %s", public_id)
+        # Оптимизированный URL (строится из public_id по шаблону)
+        return self._url_for(public_id)
+    
+    def _url_for(self, public_id: str) -> str:
+        """Оптимизированный URL по public_id без создания CloudinaryImage"""
+        return self._url_tmpl.replace(_URL_PLACEHOLDER, public_id)
+    
+    def _upload_with_retry(self, file_path: str, public_id: str, folder: str) -> dict:
+        """Загружает фото в Cloudinary, повторяя при ошибках API; последнюю ошибку пробрасывает"""
+        for attempt in range(UPLOAD_ATTEMPTS):
+            try:
+                return self.cloudinary.uploader.upload(
+                    file_path,
+                    public_id=public_id,
+                    folder=folder,
+                    overwrite=False,
+                    resource_type="image",
+                    transformation=[
+                        {"width": 1200, "height": 800, "crop": "limit", "quality": "auto"},
+                        {"fetch_format": "auto"}
+                    ]
+                )
+            except self.cloudinary.exceptions.Error as e:
+                if attempt + 1 >= UPLOAD_ATTEMPTS:
+                    raise
+                logger.warning("⚠️  Попытка %s/%s загрузки %s не удалась: %s", attempt + 1, UPLOAD_ATTEMPTS, public_id, e)
+                time.sleep(2 ** attempt)
     
     def _save_locally(self, file_path: str, car_id: int, filename_base: str, original_name: str) -> str:
         """Сохраняет фото локально (для разработки)"""
         try:
-            from PIL import Image
-            
             # Создаем имя файла
             ext = Path(original_name).suffix or ".jpg"
             filename = f"{filename_base}{ext}"
             target_path = self.upload_dir / filename
             
-            # Оптимизируем и сохраняем
-            img = Image.open(file_path)
-            
-            # Ресайз для веба
-            if img.height > 1080 or img.width > 1920:
-                img.thumbnail((1920, 1080))
-            
-            # Конвертируем в RGB если нужно
-            if img.mode in ('RGBA', 'LA'):
-                background = Image.new('RGB', img.size, (255, 255, 255))
-                background.paste(img, mask=img.split()[-1] if img.mode == 'RGBA' else img)
-                img = background
-            
-            img.save(target_path, "JPEG", quality=85, optimize=True)
+            # Уже оптимизированный JPEG просто копируем,
+            # иначе оптимизируем и сохраняем (libvips, если доступен, иначе Pillow)
+            if self._can_copy_as_is(file_path, ext):
+                shutil.copyfile(file_path, target_path)
+            elif not self._encode_with_vips(file_path, target_path, ext):
+                self._encode_with_pillow(file_path, target_path, ext)
             
             # Возвращаем веб-путь
             web_path = f"/static/uploads/cars/{filename}"
-            logger.info(f"✅ Фото сохранено локально: {target_path}")
+            logger.info("✅ Фото сохранено локально: %s", target_path)
             return web_path
             
         except Exception as e:
-            logger.error(f"❌ Ошибка локального сохранения: {e}")
+            logger.error("❌ Ошибка локального сохранения: %s", e)
             # Возвращаем placeholder
             return "/static/uploads/cars/placeholder.jpg"
     
+    @staticmethod
+    def _can_copy_as_is(file_path: str, ext: str) -> bool:
+        """Небольшой RGB JPEG в пределах 1920x1080 не нужно перекодировать"""
+        if ext.lower() not in (".jpg", ".jpeg") or os.path.getsize(file_path) >= COPY_AS_IS_MAX_BYTES:
+            return False
+        
+        from PIL import Image
+        
+        # Читается только заголовок, пиксели не декодируются
+        with Image.open(file_path) as probe:
+            width, height = probe.size
+            return probe.format == "JPEG" and probe.mode == "RGB" and width <= 1920 and height <= 1080
+    
+    def _encode_with_vips(self, file_path: str, target_path: Path, ext: str) -> bool:
+        """Ресайз и кодирование через libvips за один проход, False если недоступно"""
+        pyvips = _load_pyvips()
+        if pyvips is None:
+            return False
+        
+        try:
+            img = pyvips.Image.thumbnail(file_path, 1920, height=1080, size="down")
+            
+            # Убираем прозрачность на белом фоне
+            if img.hasalpha():
+                img = img.flatten(background=[255, 255, 255])
+            
+            if ext.lower() == ".png":
+                img.pngsave(str(target_path), compression=6)
+            else:
+                img.jpegsave(str(target_path), Q=85, optimize_coding=True, interlace=True, strip=True)
+            return True
+        except pyvips.Error as e:
+            logger.warning("⚠️  libvips не смог обработать фото, используем Pillow: %s", e)
+            return False
+    
+    def _encode_with_pillow(self, file_path: str, target_path: Path, ext: str) -> None:
+        """Ресайз и кодирование через Pillow"""
+        from PIL import Image
+        
+        # Оптимизируем и сохраняем: одно декодирование, файл закрывается сразу
+        with Image.open(file_path) as img:
+            oversized = img.height > 1080 or img.width > 1920
+            # JPEG декодируем сразу в уменьшенном масштабе (DCT scaling)
+            if oversized and img.format == "JPEG":
+                img.draft("RGB", (1920, 1080))
+            img.load()
+            
+            # Ресайз для веба
+            if oversized:
+                img.thumbnail((1920, 1080), Image.Resampling.LANCZOS, reducing_gap=2.0)
+            
+            # Конвертируем в RGB если нужно
+            if img.mode in ('LA', 'P'):
+                img = img.convert('RGBA')
+            if img.mode == 'RGBA':
+                background = Image.new('RGBA', img.size, (255, 255, 255, 255))
+                img = Image.alpha_composite(background, img).convert('RGB')
+            
+            if ext.lower() == ".png":
+                img.save(target_path, "PNG", optimize=True, compress_level=6)
+            else:
+                # Прогрессивный JPEG: меньше размер и раннее отображение в браузере
+                img.save(target_path, "JPEG", quality=85, optimize=True, progressive=True, subsampling="4:2:0")
+    
     def delete_photo(self, photo_url: str) -> bool:
         """Удаляет фото по URL"""
         if self.use_cloudinary and "res.cloudinary.com" in photo_url:
             try:
-                # Извлекаем public_id из URL
-                parts = photo_url.split('/')
-                public_id = parts[-1].split('.')[0]  # Берем имя без расширения
-                public_id = f"avtorend/{public_id}"
-                
+                public_id = self._extract_public_id(photo_url)
                 result = self.cloudinary.uploader.destroy(public_id)
                 return result.get('result') == 'ok'
             except Exception as e:
-                logger.error(f"❌ Ошибка удаления из Cloudinary: {e}")
+                logger.error("❌ Ошибка удаления из Cloudinary: %s", e)
                 return False
         
         # Локальное удаление
@@ -164,10 +265,55 @@ class CarPhotoStorage:
                     file_path.unlink()
                     return True
             except Exception as e:
-                logger.error(f"❌ Ошибка локального удаления: {e}")
+                logger.error("❌ Ошибка локального удаления: %s", e)
         
         return False
     
+    @staticmethod
+    @lru_cache(maxsize=4096)
+    def _extract_public_id(photo_url: str) -> str:
+        """Извлекает public_id (avtorend/car_<id>/...) из URL Cloudinary
+        
+        Результат зависит только от URL, поэтому кэшируется без инвалидации.
+        """
+        match = _PUBLIC_ID_RE.search(photo_url)
+        if match:
+            return match.group(1)
+        return f"avtorend/{photo_url.rsplit('/', 1)[-1].split('.')[0]}"
+    
+    def delete_photos(self, photo_urls: List[str]) -> int:
+        """Удаляет несколько фото пакетами, возвращает количество удаленных"""
+        deleted = 0
+        public_ids = []
+        local_paths = []
+        
+        for photo_url in photo_urls:
+            if self.use_cloudinary and "res.cloudinary.com" in photo_url:
+                public_ids.append(self._extract_public_id(photo_url))
+            elif photo_url.startswith('/static/'):
+                local_paths.append(Path(photo_url[1:]))
+        
+        # Cloudinary: один запрос на DELETE_BATCH_SIZE фото
+        ids = iter(public_ids)
+        while chunk := list(islice(ids, DELETE_BATCH_SIZE)):
+            try:
+                result = self.cloudinary.api.delete_resources(chunk, resource_type="image")
+                deleted += sum(1 for status in result.get('deleted', {}).values() if status == 'deleted')
+            except Exception as e:
+                logger.error("❌ Ошибка пакетного удаления из Cloudinary: %s", e)
+        
+        # Локальное удаление
+        for file_path in local_paths:
+            try:
+                file_path.unlink()
+                deleted += 1
+            except FileNotFoundError:
+                pass
+            except Exception as e:
+                logger.error("❌ Ошибка локального удаления: %s", e)
+        
+        return deleted
+    
     def delete_all_car_photos(self, car_id: int) -> bool:
         """Удаляет все фото автомобиля"""
         if self.use_cloudinary:
@@ -176,20 +322,30 @@ class CarPhotoStorage:
                 result = self.cloudinary.api.delete_resources_by_prefix(f"avtorend/car_{car_id}/")
                 return result.get('deleted', {})
             except Exception as e:
-                logger.error(f"❌ Ошибка удаления фото автомобиля: {e}")
+                logger.error("❌ Ошибка удаления фото автомобиля: %s", e)
                 return {}
         
         # Локальное удаление
         try:
-            deleted_files = []
-            pattern = f"car_{car_id}_*"
-            for file_path in self.upload_dir.glob(pattern):
-                file_path.unlink()
-                deleted_files.append(file_path.name)
-            return len(deleted_files) > 0
+            deleted_count = 0
+            prefix = f"car_{car_id}_"
+            with os.scandir(self.upload_dir) as entries:
+                for entry in entries:
+                    if entry.name.startswith(prefix) and entry.is_file(follow_symlinks=False):
+                        os.unlink(entry.path)
+                        deleted_count += 1
+            return deleted_count > 0
         except Exception as e:
-            logger.error(f"❌ Ошибка локального удаления фото: {e}")
+            logger.error("❌ Ошибка локального удаления фото: %s", e)
             return False
 
-# Синглтон экземпляр
-photo_storage = CarPhotoStorage()
+# Синглтон экземпляр (создается при первом обращении, а не при импорте)
+_photo_storage: Optional[CarPhotoStorage] = None
+
+def get_photo_storage() -> CarPhotoStorage:
+    """Возвращает общий экземпляр CarPhotoStorage"""
+    global _photo_storage
+    if _photo_storage is None:
+        _photo_storage = CarPhotoStorage()
+    return _photo_storage
+
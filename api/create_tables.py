@@ -3,19 +3,38 @@ import os
 # Добавляем папку api в путь Python
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
+from sqlalchemy import select
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+
 from api.database import engine, Base
 from api.models import Category, Car
+
+def insert_missing(conn, model, rows, key):
+    """Вставляет строки одним executemany через Core, пропуская существующие key"""
+    if not rows:
+        return
+    table = model.__table__
+    dialect = conn.dialect.name
+    if dialect == "postgresql":
+        stmt = pg_insert(table).on_conflict_do_nothing(index_elements=[key])
+    elif dialect == "sqlite":
+        stmt = sqlite_insert(table).on_conflict_do_nothing(index_elements=[key])
+    else:
+        # Прочие СУБД: проверяем существующие ключи одним SELECT
+        existing = {value for (value,) in conn.execute(select(table.c[key]))}
+        rows = [r for r in rows if r[key] not in existing]
+        if not rows:
+            return
+        stmt = table.insert()
+    conn.execute(stmt, rows)
+
 def create_tables():
     print("Создаем таблицы...")
     Base.metadata.create_all(bind=engine)
     print("Таблицы созданы!")
 
 def seed_initial_data():
-    from sqlalchemy.orm import Session
-    from database import SessionLocal
-    
-    db = SessionLocal()
-    
     # Создаем категории автомобилей
     categories_data = [
         {"name": "Эконом", "slug": "economy", "icon": "eco", "description": "Бюджетные автомобили"},
@@ -28,13 +47,9 @@ def seed_initial_data():
         {"name": "Электрокар", "slug": "electric", "icon": "electric", "description": "Электрические автомобили"},
     ]
     
-    for cat_data in categories_data:
-        category = db.query(Category).filter(Category.slug == cat_data["slug"]).first()
-        if not category:
-            category = Category(**cat_data)
-            db.add(category)
-    
-    db.commit()
+    # Один executemany на таблицу; существующие slug пропускаются на стороне БД
+    with engine.begin() as conn:
+        insert_missing(conn, Category, categories_data, "slug")
     
     # Добавляем тестовые автомобили
     cars_data = [
@@ -84,14 +99,8 @@ def seed_initial_data():
         }
     ]
     
-    for car_data in cars_data:
-        car = db.query(Car).filter(Car.license_plate == car_data["license_plate"]).first()
-        if not car:
-            car = Car(**car_data)
-            db.add(car)
-    
-    db.commit()
-    db.close()
+    with engine.begin() as conn:
+        insert_missing(conn, Car, cars_data, "license_plate")
     print("Начальные данные добавлены!")
 
 if __name__ == "__main__":
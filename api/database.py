@@ -1,8 +1,14 @@
 import os
 import sys
-from sqlalchemy import create_engine, text
-from sqlalchemy.orm import declarative_base, sessionmaker
-from sqlalchemy.exc import SQLAlchemyError
+import threading
+import time
+from contextlib import contextmanager
+from sqlalchemy import create_engine, event, text
+from sqlalchemy.engine import make_url
+from sqlalchemy.orm import declarative_base, scoped_session, sessionmaker
+from sqlalchemy.exc import DisconnectionError, SQLAlchemyError
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
+from sqlalchemy.pool import NullPool
 from dotenv import load_dotenv
 import logging
 
@@ -15,6 +21,24 @@ logger = logging.getLogger(__name__)
 
 load_dotenv()
 
+# Соединение, простаивавшее дольше этого времени, проверяется SELECT 1 при выдаче из пула
+POOL_PING_IDLE_SECONDS = int(os.getenv("DB_POOL_PING_IDLE_SECONDS", "60"))
+
+# Лимиты действуют на каждый engine каждого процесса. Процесс создает два engine (sync и async),
+# но пул открывает соединения лениво: воркер API ходит в БД только через async engine,
+# бот — только через sync. Итого на сервер:
+#   (WEB_CONCURRENCY + 1 бот) * (DB_POOL_SIZE + DB_MAX_OVERFLOW)
+# Держите ниже max_connections БД (с запасом под миграции и psql). Потолок, если бы
+# использовались оба engine в каждом процессе, — вдвое больше.
+POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "10"))
+MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", "10"))
+
+# Сколько секунд переиспользуем успешный результат test_connection()
+TEST_CONNECTION_TTL_SECONDS = int(os.getenv("DB_TEST_CONNECTION_TTL_SECONDS", "60"))
+_probe_lock = threading.Lock()
+_last_probe_time = 0.0
+_last_probe_result = None
+
 
 def _is_production() -> bool:
     return os.getenv("ENVIRONMENT", "development").strip().lower() in {"prod", "production"}
@@ -41,7 +65,8 @@ def get_database_url():
         else:
             logger.info("📁 Используется внешняя PostgreSQL")
         
-        logger.info(f"🔧 URL БД: {database_url.split('@')[1] if '@' in database_url else database_url[:50]}...")
+        if logger.isEnabledFor(logging.INFO):
+            logger.info("🔧 URL БД: %s...", database_url.split('@')[1] if '@' in database_url else database_url[:50])
         return database_url
     
     # 3. Если DATABASE_URL нет
@@ -56,55 +81,84 @@ def get_database_url():
     for var_name in ["POSTGRES_URL", "POSTGRESQL_URL", "DB_URL"]:
         alt_url = os.getenv(var_name)
         if alt_url:
-            logger.info(f"✅ Найден альтернативный URL: {var_name}")
+            logger.info("✅ Найден альтернативный URL: %s", var_name)
             return alt_url
     
     # 3.2 Фоллбэк для разработки/локального тестирования
     logger.warning("ℹ️  DATABASE_URL не установлен. Используем SQLite для разработки.")
     return os.getenv("DEV_SQLITE_URL", "sqlite:///./avtorend_test.db")
 
+def _install_idle_ping(engine):
+    """Пингуем только "холодные" соединения вместо pool_pre_ping на каждый checkout"""
+
+    @event.listens_for(engine, "checkin")
+    def _on_checkin(dbapi_connection, connection_record):
+        connection_record.info["last_used"] = time.monotonic()
+
+    @event.listens_for(engine, "checkout")
+    def _on_checkout(dbapi_connection, connection_record, connection_proxy):
+        last_used = connection_record.info.get("last_used")
+        if last_used is None or time.monotonic() - last_used < POOL_PING_IDLE_SECONDS:
+            return
+        cursor = dbapi_connection.cursor()
+        try:
+            cursor.execute("SELECT 1")
+        except Exception as e:
+            # Пул выбросит это соединение и откроет новое
+            raise DisconnectionError() from e
+        finally:
+            cursor.close()
+
+def _connect_args(database_url):
+    """Параметры подключения для SQLite / PostgreSQL на Render"""
+    # Для SQLite
+    if "sqlite" in database_url:
+        return {"check_same_thread": False}
+    
+    # Важные настройки для Render PostgreSQL
+    return {
+        "connect_timeout": 10,
+        "keepalives": 1,
+        "keepalives_idle": 30,
+        "keepalives_interval": 10,
+        "keepalives_count": 5
+    }
+
+def _make_admin_engine():
+    """Engine без пула для разовых админ-операций (проверка связи, создание таблиц)"""
+    database_url = get_database_url()
+    return create_engine(database_url, poolclass=NullPool, connect_args=_connect_args(database_url))
+
 def create_db_engine():
     """Создаем engine с настройками для Render"""
     
     database_url = get_database_url()
     
     # Параметры подключения
-    connect_args = {}
-    
-    # Для SQLite
+    connect_args = _connect_args(database_url)
     if "sqlite" in database_url:
-        connect_args = {"check_same_thread": False}
         logger.warning("⚠️  Используется SQLite! Данные будут храниться временно.")
     
-    # Для PostgreSQL на Render
-    else:
-        # Важные настройки для Render PostgreSQL
-        connect_args = {
-            "connect_timeout": 10,
-            "keepalives": 1,
-            "keepalives_idle": 30,
-            "keepalives_interval": 10,
-            "keepalives_count": 5
-        }
-    
     try:
         engine = create_engine(
             database_url,
             # Оптимальные настройки для Render
-            pool_size=5,           # Меньше для бесплатного плана
-            max_overflow=10,       # Небольшой оверфлоу
-            pool_pre_ping=True,    # Критически важно для Render!
+            pool_size=POOL_SIZE,
+            max_overflow=MAX_OVERFLOW,
+            pool_pre_ping=False,   # Пингуем только простаивавшие соединения (см. _install_idle_ping)
+            pool_use_lifo=True,    # "Горячие" соединения переиспользуются, холодные стареют
             pool_recycle=300,      # Пересоздавать соединения
             pool_timeout=30,       # Таймаут для получения соединения
             echo=False,            # Не логировать SQL (можно включить для дебага)
             connect_args=connect_args
         )
+        _install_idle_ping(engine)
         
         logger.info("✅ Engine базы данных создан")
         return engine
         
     except Exception as e:
-        logger.error(f"❌ Ошибка создания engine: {e}")
+        logger.error("❌ Ошибка создания engine: %s", e)
         
         # В продакшене не делаем скрытых фоллбэков.
         if _is_production():
@@ -126,10 +180,76 @@ def create_db_engine():
             connect_args={"check_same_thread": False}
         )
 
-def test_connection():
-    """Тестируем подключение к базе данных"""
+def _async_database_url(database_url):
+    """URL с асинхронным драйвером: asyncpg для PostgreSQL, aiosqlite для SQLite"""
+    scheme, sep, rest = database_url.partition("://")
+    if scheme.startswith("postgresql"):
+        return f"postgresql+asyncpg{sep}{rest}"
+    if scheme.startswith("sqlite"):
+        return f"sqlite+aiosqlite{sep}{rest}"
+    return database_url
+
+def _split_asyncpg_ssl(database_url):
+    """Убирает libpq-параметр sslmode из URL (asyncpg его не принимает).
+    
+    Возвращает (url, ssl): значение sslmode (require, verify-full, ...) asyncpg
+    понимает в аргументе подключения ssl. ssl=None — параметра в URL не было.
+    """
+    url = make_url(database_url)
+    sslmode = url.query.get("sslmode")
+    if sslmode is None:
+        return url, None
+    return url.difference_update_query(["sslmode"]), sslmode
+
+def create_async_db_engine():
+    """AsyncEngine для async-эндпоинтов API (asyncpg / aiosqlite)"""
+    database_url = _async_database_url(get_database_url())
+    
+    if "sqlite" in database_url:
+        return create_async_engine(database_url, echo=False)
+    
+    # Managed PostgreSQL (Render и др.) часто отдает URL с ?sslmode=require
+    database_url, ssl = _split_asyncpg_ssl(database_url)
+    connect_args = {"timeout": 10}  # asyncpg не знает libpq-параметров keepalives
+    if ssl is not None:
+        connect_args["ssl"] = ssl
+    
+    async_engine = create_async_engine(
+        database_url,
+        pool_size=POOL_SIZE,
+        max_overflow=MAX_OVERFLOW,
+        pool_pre_ping=False,   # См. _install_idle_ping
+        pool_use_lifo=True,
+        pool_recycle=300,
+        pool_timeout=30,
+        echo=False,
+        connect_args=connect_args,
+    )
+    _install_idle_ping(async_engine.sync_engine)
+    return async_engine
+
+def test_connection(use_cache: bool = True):
+    """Тестируем подключение к базе данных
+    
+    Успешный результат кэшируется на TEST_CONNECTION_TTL_SECONDS:
+    схема меняется редко, а запрос к information_schema недешевый.
+    """
+    global _last_probe_time, _last_probe_result
+    
+    with _probe_lock:
+        now = time.monotonic()
+        if use_cache and _last_probe_result is not None and now - _last_probe_time < TEST_CONNECTION_TTL_SECONDS:
+            return _last_probe_result
+        
+        result = _probe_connection()
+        if result["connected"]:
+            _last_probe_time, _last_probe_result = now, result
+        return result
+
+def _probe_connection():
+    """Проверка подключения и списка таблиц (без кэша)"""
     try:
-        engine = create_db_engine()
+        engine = _make_admin_engine()
         with engine.connect() as conn:
             # Разный SQL для разных СУБД
             if "sqlite" in str(engine.url):
@@ -153,10 +273,10 @@ def test_connection():
             
             tables = [row[0] for row in result]
             
-            logger.info(f"✅ Подключение к БД успешно: {db_type} v{version}")
-            logger.info(f"📊 Таблиц в базе: {len(tables)}")
+            logger.info("✅ Подключение к БД успешно: %s v%s", db_type, version)
+            logger.info("📊 Таблиц в базе: %s", len(tables))
             if tables:
-                logger.info(f"📋 Таблицы: {tables}")
+                logger.info("📋 Таблицы: %s", tables)
             
             return {
                 "connected": True,
@@ -167,7 +287,7 @@ def test_connection():
             }
             
     except Exception as e:
-        logger.error(f"❌ Ошибка подключения к БД: {e}")
+        logger.error("❌ Ошибка подключения к БД: %s", e)
         return {
             "connected": False,
             "error": str(e),
@@ -180,7 +300,7 @@ try:
     # Не тестируем при импорте - может замедлить запуск
     logger.info("🔧 Engine инициализирован (тестирование отложено)")
 except Exception as e:
-    logger.error(f"❌ Не удалось создать engine: {e}")
+    logger.error("❌ Не удалось создать engine: %s", e)
     engine = None
 
 # Создаем сессии
@@ -195,6 +315,30 @@ else:
     SessionLocal = None
     logger.warning("⚠️  SessionLocal не создан.")
 
+# Реестр сессий на поток для бота: соединения берутся из общего пула engine,
+# сессия живет до конца session_scope()
+ScopedSession = scoped_session(SessionLocal) if SessionLocal else None
+
+# Асинхронный engine и сессии для API
+try:
+    async_engine = create_async_db_engine()
+    logger.info("🔧 AsyncEngine инициализирован")
+except Exception as e:
+    logger.error("❌ Не удалось создать AsyncEngine: %s", e)
+    if _is_production():
+        raise
+    async_engine = None
+
+if async_engine:
+    AsyncSessionLocal = async_sessionmaker(
+        bind=async_engine,
+        autoflush=False,
+        expire_on_commit=False
+    )
+else:
+    AsyncSessionLocal = None
+    logger.warning("⚠️  AsyncSessionLocal не создан.")
+
 # Базовый класс для моделей
 Base = declarative_base()
 
@@ -209,12 +353,50 @@ def get_db():
     try:
         yield db
     except SQLAlchemyError as e:
-        logger.error(f"❌ Ошибка БД в сессии: {e}")
+        logger.error("❌ Ошибка БД в сессии: %s", e)
         db.rollback()
         raise
     finally:
         db.close()
 
+@contextmanager
+def session_scope():
+    """Сессия из ScopedSession: commit при успехе, rollback при ошибке, remove() в конце.
+    
+    Внутри блока не должно быть await: в одном потоке event loop сессия общая для всех корутин.
+    """
+    if ScopedSession is None:
+        logger.error("❌ SessionLocal не инициализирован")
+        raise RuntimeError("Database is not initialized")
+    
+    db = ScopedSession()
+    try:
+        yield db
+        db.commit()
+    except SQLAlchemyError as e:
+        logger.error("❌ Ошибка БД в сессии: %s", e)
+        db.rollback()
+        raise
+    except BaseException:
+        db.rollback()
+        raise
+    finally:
+        ScopedSession.remove()
+
+async def get_async_db():
+    """Dependency для получения асинхронной сессии БД"""
+    if AsyncSessionLocal is None:
+        logger.error("❌ AsyncSessionLocal не инициализирован")
+        raise RuntimeError("Database is not initialized")
+    
+    async with AsyncSessionLocal() as db:
+        try:
+            yield db
+        except SQLAlchemyError as e:
+            logger.error("❌ Ошибка БД в сессии: %s", e)
+            await db.rollback()
+            raise
+
 # Функция для создания таблиц
 def create_tables():
     """Создает все таблицы в базе данных"""
@@ -232,11 +414,12 @@ def create_tables():
             import api.models  # noqa: F401
 
         logger.info("🗄️  Начинаем создание таблиц...")
-        Base.metadata.create_all(bind=engine)
+        admin_engine = _make_admin_engine()
+        Base.metadata.create_all(bind=admin_engine)
         
         # Проверяем что создалось
-        with engine.connect() as conn:
-            if "sqlite" in str(engine.url):
+        with admin_engine.connect() as conn:
+            if "sqlite" in str(admin_engine.url):
                 result = conn.execute(text("SELECT COUNT(name) FROM sqlite_master WHERE type='table';"))
             else:
                 result = conn.execute(text("""
@@ -247,11 +430,11 @@ def create_tables():
             
             table_count = result.scalar()
         
-        logger.info(f"✅ Таблицы успешно созданы. Всего таблиц: {table_count}")
+        logger.info("✅ Таблицы успешно созданы. Всего таблиц: %s", table_count)
         return True
         
     except Exception as e:
-        logger.error(f"❌ Ошибка при создании таблиц: {e}")
+        logger.error("❌ Ошибка при создании таблиц: %s", e)
         return False
 
 
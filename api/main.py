@@ -9,19 +9,31 @@ Key principles applied:
 
 from __future__ import annotations
 
+import gzip
+import hashlib
+import hmac
+import logging
+import mimetypes
 import os
 import sys
 import time
 from contextlib import asynccontextmanager
-from datetime import datetime
+from datetime import datetime, timezone
 from pathlib import Path
-from typing import List, Optional
+from typing import Dict, FrozenSet, List, Optional, Tuple
 
-from fastapi import Depends, FastAPI, HTTPException, Query, Request, Response
+from fastapi import Depends, FastAPI, Header, HTTPException, Query, Request, Response
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.middleware.gzip import GZipMiddleware
 from fastapi.responses import FileResponse, JSONResponse
 from fastapi.staticfiles import StaticFiles
-from sqlalchemy.orm import Session
+from starlette.datastructures import Headers, MutableHeaders
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+import orjson
+from pydantic import TypeAdapter
+from sqlalchemy import func, select
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import selectinload
 
 
 def _env() -> str:
@@ -32,26 +44,47 @@ def _is_production() -> bool:
     return _env() in {"prod", "production"}
 
 
+logger = logging.getLogger(__name__)
+
+
 # --- Imports (support both `uvicorn api.main:app` and `uvicorn main:app` from /api) ---
 try:
     from api import models, schemas
-    from api.database import get_db, engine
+    from api.database import async_engine, get_async_db, engine
 except Exception:
     # Local execution from the /api directory
     current_dir = os.path.dirname(os.path.abspath(__file__))
     if current_dir not in sys.path:
         sys.path.append(current_dir)
     import models, schemas  # type: ignore
-    from database import get_db, engine  # type: ignore
+    from database import async_engine, get_async_db, engine  # type: ignore
 
 
-def _parse_allowed_origins() -> List[str]:
+def _parse_allowed_origins() -> FrozenSet[str]:
+    """Normalized origin set: browsers send origins without a trailing slash."""
     raw = os.getenv("ALLOWED_ORIGINS", "").strip()
     if not raw:
         if _is_production():
             raise RuntimeError("ALLOWED_ORIGINS is required in production")
-        return ["*"]
-    return [o.strip() for o in raw.split(",") if o.strip()]
+        return frozenset(("*",))
+    origins = frozenset(o.strip().rstrip("/") for o in raw.split(",") if o.strip())
+    if "*" in origins:
+        return frozenset(("*",))
+    return origins
+
+
+UPLOAD_DIRS = ("static/uploads/cars", "static/uploads/temp")
+_INIT_DONE = False
+
+
+def _init_runtime_dirs() -> None:
+    """Create upload directories under the project root, once per process."""
+    global _INIT_DONE
+    if _INIT_DONE:
+        return
+    for rel_path in UPLOAD_DIRS:
+        (BASE_DIR / rel_path).mkdir(parents=True, exist_ok=True)
+    _INIT_DONE = True
 
 
 @asynccontextmanager
@@ -62,19 +95,31 @@ async def lifespan(app: FastAPI):
         if not os.getenv("DATABASE_URL"):
             raise RuntimeError("DATABASE_URL is required in production")
 
-    # Create required runtime directories (uploads).
-    os.makedirs("static/uploads/cars", exist_ok=True)
-    os.makedirs("static/uploads/temp", exist_ok=True)
+    _init_runtime_dirs()
 
     # NOTE: No Base.metadata.create_all() and no seeding here.
     # Use Alembic migrations / explicit admin scripts.
+    # No blocking DB ping either: the async pool connects on first request.
     yield
 
     # Shutdown
+    if async_engine:
+        await async_engine.dispose()
     if engine:
         engine.dispose()
 
 
+class OrjsonResponse(JSONResponse):
+    """JSON response rendered with orjson (handles datetime natively).
+
+    Used for hand-built dict responses. Routes with a response_model are
+    already serialized to bytes by Pydantic, so they keep the default class.
+    """
+
+    def render(self, content) -> bytes:
+        return orjson.dumps(content, option=orjson.OPT_NON_STR_KEYS)
+
+
 app = FastAPI(
     title="AvtoRend API",
     description="API для аренды автомобилей",
@@ -87,6 +132,7 @@ app = FastAPI(
 
 
 # --- CORS ---
+# Parsed once; a frozenset makes the per-request origin check a hash lookup.
 allowed_origins = _parse_allowed_origins()
 
 # If credentials are enabled, wildcard origins are invalid per browser CORS rules.
@@ -95,14 +141,19 @@ if allow_credentials and "*" in allowed_origins:
     # Fail-safe: disable credentials rather than crashing at runtime.
     allow_credentials = False
 
+# CORSMiddleware joins these into its preflight header once, at construction.
+CORS_ALLOW_METHODS = ("GET", "POST", "PUT", "DELETE", "OPTIONS", "PATCH")
+# Browsers clamp this (Chrome to 2h), but there is no reason to re-send preflights every 10 minutes.
+CORS_MAX_AGE = int(os.getenv("CORS_MAX_AGE", "86400"))
+
 app.add_middleware(
     CORSMiddleware,
     allow_origins=allowed_origins,
     allow_credentials=allow_credentials,
-    allow_methods=["GET", "POST", "PUT", "DELETE", "OPTIONS", "PATCH"],
+    allow_methods=CORS_ALLOW_METHODS,
     allow_headers=["*"],
     expose_headers=["Content-Disposition", "X-Total-Count"],
-    max_age=600,
+    max_age=CORS_MAX_AGE,
 )
 
 # --- Static files / SPA hosting ---
@@ -117,62 +168,186 @@ STATIC_DIRS = [
     ("/static", "static"),
     ("/images", "images"),
 ]
+# Path prefixes (without the leading slash) owned by the mounts above.
+_STATIC_PREFIXES = tuple(f"{dir_name}/" for _, dir_name in STATIC_DIRS)
+
+
+# --- Compression ---
+class ApiGZipMiddleware(GZipMiddleware):
+    """GZipMiddleware that leaves the static mounts alone.
+
+    CachedStaticFiles sends pre-compressed bodies with their own Vary header;
+    passing them through GZipMiddleware would duplicate Vary and, on Starlette
+    versions that ignore an existing Content-Encoding, compress them twice.
+    """
+
+    _static_routes = tuple(f"{route}/" for route, _ in STATIC_DIRS)
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] == "http" and scope["path"].startswith(self._static_routes):
+            await self.app(scope, receive, send)
+            return
+        await super().__call__(scope, receive, send)
+
+
+# JSON listings and the SPA shell compress 5-10x; tiny bodies are not worth it.
+app.add_middleware(ApiGZipMiddleware, minimum_size=1024, compresslevel=5)
+
+# Small assets are read once at startup and served from memory.
+# Uploads change at runtime, so they always go through the regular StaticFiles path.
+ASSET_CACHE_MAX_BYTES = 1024 * 1024
+ASSET_CACHE_EXCLUDE = ("uploads/",)
+# Asset names are not content-hashed, so browsers revalidate via ETag after max-age.
+STATIC_CACHE_CONTROL = os.getenv("STATIC_CACHE_CONTROL", "public, max-age=3600")
+
+
+COMPRESSIBLE_TYPES = ("text/", "application/json", "application/javascript", "application/manifest+json", "image/svg+xml")
+
+
+class CachedStaticFiles(StaticFiles):
+    """StaticFiles that serves small files from an in-memory cache.
+
+    Text assets are gzipped once at startup, so GZipMiddleware
+    does not recompress them on every request.
+    """
+
+    def __init__(self, *, directory: str, **kwargs):
+        super().__init__(directory=directory, **kwargs)
+        self._cache: Dict[str, Tuple[bytes, str, str, Optional[bytes]]] = {}
+
+        root = Path(directory)
+        for file_path in root.rglob("*"):
+            rel_path = file_path.relative_to(root).as_posix()
+            if not file_path.is_file() or rel_path.startswith(ASSET_CACHE_EXCLUDE):
+                continue
+            if file_path.stat().st_size > ASSET_CACHE_MAX_BYTES:
+                continue
+            body = file_path.read_bytes()
+            media_type = mimetypes.guess_type(file_path.name)[0] or "application/octet-stream"
+            etag = f'"{hashlib.md5(body).hexdigest()}"'
+            gzipped = None
+            if media_type.startswith(COMPRESSIBLE_TYPES) and len(body) >= 1024:
+                gzipped = gzip.compress(body, compresslevel=9, mtime=0)
+            self._cache[os.path.normpath(rel_path)] = (body, media_type, etag, gzipped)
+
+    async def get_response(self, path: str, scope: Scope) -> Response:
+        hit = self._cache.get(path)
+        if hit is None or scope["method"] not in ("GET", "HEAD"):
+            return await super().get_response(path, scope)
+
+        body, media_type, etag, gzipped = hit
+        request_headers = Headers(scope=scope)
+        headers = {"Cache-Control": STATIC_CACHE_CONTROL}
+        if gzipped is not None:
+            headers["Vary"] = "Accept-Encoding"
+            if "gzip" in request_headers.get("accept-encoding", ""):
+                body = gzipped
+                etag = etag[:-1] + '-gz"'
+                headers["Content-Encoding"] = "gzip"
+        headers["ETag"] = etag
+
+        if etag in request_headers.get("if-none-match", ""):
+            return Response(status_code=304, headers=headers)
+        return Response(body, media_type=media_type, headers=headers)
+
 
 for route, dir_name in STATIC_DIRS:
     dir_path = BASE_DIR / dir_name
     if dir_path.exists():
-        app.mount(route, StaticFiles(directory=str(dir_path)), name=dir_name)
+        app.mount(route, CachedStaticFiles(directory=str(dir_path)), name=dir_name)
+
+
+def _file_stat(path: Path) -> Optional[os.stat_result]:
+    try:
+        return os.stat(path)
+    except OSError:
+        return None
+
+
+# Root files are stat'ed once; FileResponse then skips the per-request stat.
+INDEX_PATH = BASE_DIR / "index.html"
+SW_PATH = BASE_DIR / "sw.js"
+FAVICON_PATH = BASE_DIR / "static" / "favicon.ico"
+_INDEX_STAT = _file_stat(INDEX_PATH)
+_SW_STAT = _file_stat(SW_PATH)
+_FAVICON_STAT = _file_stat(FAVICON_PATH)
+
+
+def _index_response():
+    if _INDEX_STAT is None:
+        return OrjsonResponse(status_code=404, content={"error": "index.html not found"})
+    return FileResponse(str(INDEX_PATH), stat_result=_INDEX_STAT, headers={"Cache-Control": "no-cache"})
 
 
 # --- Request logging (keep it lightweight; optionally disable in prod) ---
 LOG_REQUESTS = os.getenv("LOG_REQUESTS", "true").strip().lower() in {"1", "true", "yes"}
+_LOG_SKIP = frozenset(("/health", "/favicon.ico"))
+
+
+class RequestLogMiddleware:
+    """Pure ASGI request logger: adds X-Process-Time without buffering the response."""
 
+    def __init__(self, app: ASGIApp) -> None:
+        self.app = app
 
-@app.middleware("http")
-async def log_requests(request: Request, call_next):
-    if not LOG_REQUESTS:
-        return await call_next(request)
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
 
-    start_time = time.time()
-    if request.url.path not in {"/health", "/favicon.ico"}:
-        print(f"🌐 {request.method} {request.url.path} - start")
+        start_time = time.perf_counter()
 
-    response = await call_next(request)
+        async def send_with_timing(message: Message) -> None:
+            if message["type"] == "http.response.start":
+                process_time = time.perf_counter() - start_time
+                MutableHeaders(scope=message).append("X-Process-Time", f"{process_time:.6f}")
+                if scope["path"] not in _LOG_SKIP:
+                    logger.info(
+                        "%s %s - %s %.3fs", scope["method"], scope["path"], message["status"], process_time
+                    )
+            await send(message)
 
-    process_time = time.time() - start_time
-    if request.url.path not in {"/health", "/favicon.ico"}:
-        print(f"✅ {request.method} {request.url.path} - {process_time:.3f}s")
-    response.headers["X-Process-Time"] = str(process_time)
-    return response
+        await self.app(scope, receive, send_with_timing)
+
+
+if LOG_REQUESTS:
+    app.add_middleware(RequestLogMiddleware)
 
 
 # --- Routes ---
 
 
-@app.get("/health")
+# Fixed at import; /health reports uptime from the monotonic clock instead of formatting "now".
+_BOOT_TS = datetime.now(timezone.utc).isoformat()
+_BOOT_MONO = time.monotonic()
+
+
+@app.get("/health", response_class=OrjsonResponse)
 async def health_check():
     return {
         "status": "healthy",
         "service": "avtorend-api",
         "environment": _env(),
-        "timestamp": datetime.now().isoformat(),
+        "boot": _BOOT_TS,
+        "uptime_s": round(time.monotonic() - _BOOT_MONO, 1),
     }
 
 
 @app.get("/")
 async def read_root():
-    index_path = BASE_DIR / "index.html"
-    if index_path.exists():
-        return FileResponse(str(index_path))
-    return JSONResponse(status_code=404, content={"error": "index.html not found"})
+    return _index_response()
 
 
 @app.get("/sw.js", include_in_schema=False)
 async def service_worker():
-    sw_path = BASE_DIR / "sw.js"
-    if sw_path.exists():
-        return FileResponse(str(sw_path), media_type="application/javascript")
-    return JSONResponse(status_code=404, content={"error": "sw.js not found"})
+    if _SW_STAT is not None:
+        return FileResponse(
+            str(SW_PATH),
+            media_type="application/javascript",
+            stat_result=_SW_STAT,
+            headers={"Cache-Control": "no-cache"},
+        )
+    return OrjsonResponse(status_code=404, content={"error": "sw.js not found"})
 
 
 if not _is_production():
@@ -191,18 +366,60 @@ if not _is_production():
         }
 
 
+# --- Categories cache ---
+# Категории меняются только действиями админа, поэтому держим их в памяти процесса.
+CATEGORIES_CACHE_TTL = float(os.getenv("CATEGORIES_CACHE_TTL", "30"))
+ADMIN_API_TOKEN = os.getenv("ADMIN_API_TOKEN", "").strip()
+_categories_cache: Optional[Tuple[float, bytes]] = None
+# Validates ORM rows and dumps JSON in one pass; the cached bytes skip FastAPI's response validation.
+_CATEGORY_LIST = TypeAdapter(List[schemas.Category])
+
+
 @app.get("/api/categories", response_model=List[schemas.Category])
-def get_categories(db: Session = Depends(get_db)):
+async def get_categories(db: AsyncSession = Depends(get_async_db)):
+    global _categories_cache
+
+    if _categories_cache is not None and time.monotonic() - _categories_cache[0] < CATEGORIES_CACHE_TTL:
+        return Response(_categories_cache[1], media_type="application/json")
+
     try:
-        return db.query(models.Category).filter(models.Category.is_active == True).all()
+        result = await db.execute(select(models.Category).where(models.Category.is_active == True))
+        rows = result.scalars().all()
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Ошибка получения категорий: {str(e)}")
 
+    body = _CATEGORY_LIST.dump_json(_CATEGORY_LIST.validate_python(rows, from_attributes=True))
+    _categories_cache = (time.monotonic(), body)
+    return Response(body, media_type="application/json")
+
+
+@app.post("/api/admin/invalidate-categories", include_in_schema=False)
+async def invalidate_categories(x_admin_token: Optional[str] = Header(None)):
+    # Without ADMIN_API_TOKEN configured the endpoint is disabled.
+    if not ADMIN_API_TOKEN or not hmac.compare_digest(
+        (x_admin_token or "").encode(), ADMIN_API_TOKEN.encode()
+    ):
+        raise HTTPException(status_code=403, detail="Forbidden")
+
+    # The cache is per process: only the worker that served this request is reset,
+    # other workers pick up changes when their CATEGORIES_CACHE_TTL expires.
+    global _categories_cache
+    _categories_cache = None
+    return {"invalidated": True, "scope": "worker", "pid": os.getpid(), "max_stale_seconds": CATEGORIES_CACHE_TTL}
+
 
-@app.get("/api/cars", response_model=List[schemas.Car])
-def get_cars(
+_ALLOWED_STATUSES = frozenset(s.value for s in models.CarStatus)
+_ALLOWED_STATUSES_TEXT = ", ".join(sorted(_ALLOWED_STATUSES))
+
+
+# Columns fetched for the list view: exactly the fields of CarSummary.
+_CAR_SUMMARY_COLUMNS = tuple(getattr(models.Car, name) for name in schemas.CarSummary.model_fields)
+
+
+@app.get("/api/cars", response_model=List[schemas.CarSummary])
+async def get_cars(
     response: Response,
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_async_db),
     category_id: Optional[int] = Query(None, description="ID категории"),
     brand: Optional[str] = Query(None, description="Марка автомобиля"),
     min_price: Optional[float] = Query(None, description="Минимальная цена"),
@@ -210,42 +427,76 @@ def get_cars(
     status: Optional[str] = Query(None, description="Статус автомобиля (AVAILABLE/UNAVAILABLE)"),
     limit: int = Query(100, ge=1, le=100, description="Лимит записей"),
     offset: int = Query(0, ge=0, description="Смещение"),
+    with_total: bool = Query(True, description="Вернуть общее количество в заголовке X-Total-Count"),
 ):
     try:
-        query = db.query(models.Car).filter(models.Car.is_active == True)
+        filters = [models.Car.is_active == True]
 
         if category_id:
-            query = query.filter(models.Car.category_id == category_id)
+            filters.append(models.Car.category_id == category_id)
         if brand:
-            query = query.filter(models.Car.brand.ilike(f"%{brand}%"))
+            # Префиксный поиск использует индекс ix_cars_brand_lower, '%x%' — нет
+            filters.append(func.lower(models.Car.brand).startswith(brand.strip().lower(), autoescape=True))
         if min_price is not None:
-            query = query.filter(models.Car.daily_price >= min_price)
+            filters.append(models.Car.daily_price >= min_price)
         if max_price is not None:
-            query = query.filter(models.Car.daily_price <= max_price)
+            filters.append(models.Car.daily_price <= max_price)
         if status:
-            status_norm = status.strip().upper()
-            allowed = {s.value for s in models.CarStatus}
-            if status_norm not in allowed:
+            # Имена и значения CarStatus совпадают, поэтому ищем прямо по __members__
+            status_enum = models.CarStatus.__members__.get(status.strip().upper())
+            if status_enum is None:
                 raise HTTPException(
                     status_code=422,
-                    detail=f"Неверный статус '{status}'. Допустимые: {', '.join(sorted(allowed))}",
+                    detail=f"Неверный статус '{status}'. Допустимые: {_ALLOWED_STATUSES_TEXT}",
                 )
-            query = query.filter(models.Car.status == models.CarStatus(status_norm))
-
-        total_count = query.count()
-        cars = query.offset(offset).limit(limit).all()
-        response.headers["X-Total-Count"] = str(total_count)
-        return cars
+            filters.append(models.Car.status == status_enum)
+
+        # Один запрос: страница + общее количество через оконную функцию
+        stmt = select(*_CAR_SUMMARY_COLUMNS).where(*filters)
+        if with_total:
+            stmt = stmt.add_columns(func.count().over().label("total"))
+        rows = (await db.execute(stmt.offset(offset).limit(limit))).all()
+
+        if with_total:
+            if rows:
+                total_count = rows[0].total
+            elif offset:
+                # Страница за пределами выборки — окно пустое, считаем отдельно
+                total_count = await db.scalar(select(func.count()).select_from(models.Car).where(*filters))
+            else:
+                total_count = 0
+            response.headers["X-Total-Count"] = str(total_count)
+        return rows
     except HTTPException:
         raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Ошибка получения автомобилей: {str(e)}")
 
 
-@app.get("/api/cars/{car_id}", response_model=schemas.Car)
-def get_car(car_id: int, db: Session = Depends(get_db)):
+@app.get("/api/cars/{car_id}", response_model=schemas.CarDetail)
+async def get_car(car_id: int, db: AsyncSession = Depends(get_async_db)):
+    try:
+        result = await db.execute(
+            select(models.Car)
+            .options(selectinload(models.Car.category))
+            .where(models.Car.id == car_id)
+        )
+        car = result.scalar_one_or_none()
+        if not car:
+            raise HTTPException(status_code=404, detail="Автомобиль не найден")
+        return car
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Ошибка получения автомобиля: {str(e)}")
+
+
+@app.get("/api/cars/{car_id}/summary", response_model=schemas.CarSummary)
+async def get_car_summary(car_id: int, db: AsyncSession = Depends(get_async_db)):
+    """Lightweight card data: skips description, features and the other detail columns."""
     try:
-        car = db.query(models.Car).filter(models.Car.id == car_id).first()
+        result = await db.execute(select(*_CAR_SUMMARY_COLUMNS).where(models.Car.id == car_id))
+        car = result.first()
         if not car:
             raise HTTPException(status_code=404, detail="Автомобиль не найден")
         return car
@@ -257,9 +508,8 @@ def get_car(car_id: int, db: Session = Depends(get_db)):
 
 @app.get("/favicon.ico", include_in_schema=False)
 async def favicon():
-    favicon_path = BASE_DIR / "static" / "favicon.ico"
-    if favicon_path.exists():
-        return FileResponse(str(favicon_path))
+    if _FAVICON_STAT is not None:
+        return FileResponse(str(FAVICON_PATH), stat_result=_FAVICON_STAT)
     return Response(status_code=204)
 
 
@@ -270,17 +520,13 @@ async def favicon():
 async def spa_fallback(full_path: str):
     # Skip API paths
     if full_path.startswith("api/"):
-        return JSONResponse(status_code=404, content={"error": "Not Found"})
+        return OrjsonResponse(status_code=404, content={"error": "Not Found"})
 
     # Skip known static mount prefixes
-    static_prefixes = ("styles/", "js/", "locales/", "static/", "images/")
-    if any(full_path.startswith(p) for p in static_prefixes):
-        return JSONResponse(status_code=404, content={"error": "Not Found"})
+    if full_path.startswith(_STATIC_PREFIXES):
+        return OrjsonResponse(status_code=404, content={"error": "Not Found"})
 
-    index_path = BASE_DIR / "index.html"
-    if index_path.exists():
-        return FileResponse(str(index_path))
-    return JSONResponse(status_code=404, content={"error": "index.html not found"})
+    return _index_response()
 
 
 # --- Error handlers ---
@@ -289,7 +535,7 @@ from starlette.exceptions import HTTPException as StarletteHTTPException
 
 @app.exception_handler(StarletteHTTPException)
 async def http_exception_handler(request: Request, exc: StarletteHTTPException):
-    return JSONResponse(status_code=exc.status_code, content={"error": exc.detail, "path": str(request.url.path)})
+    return OrjsonResponse(status_code=exc.status_code, content={"error": exc.detail, "path": str(request.url.path)})
 
 
 @app.exception_handler(Exception)
@@ -298,7 +544,7 @@ async def general_exception_handler(request: Request, exc: Exception):
 
     debug = os.getenv("DEBUG", "false").strip().lower() in {"1", "true", "yes"} and not _is_production()
     details = traceback.format_exc() if debug else None
-    return JSONResponse(
+    return OrjsonResponse(
         status_code=500,
         content={
             "error": "Внутренняя ошибка сервера",
@@ -314,4 +560,16 @@ if __name__ == "__main__":
 
     host = os.getenv("HOST", "0.0.0.0")
     port = int(os.getenv("PORT", 8000))
-    uvicorn.run("main:app", host=host, port=port, reload=not _is_production())
+    reload = not _is_production()
+    # "auto" picks uvloop/httptools from uvicorn[standard] when installed
+    # (uvloop is not available on Windows) and falls back to asyncio/h11.
+    # Uvicorn ignores workers under reload, so pass them only when reload is off.
+    uvicorn.run(
+        "main:app",
+        host=host,
+        port=port,
+        loop="auto",
+        http="auto",
+        reload=reload,
+        workers=None if reload else int(os.getenv("WEB_CONCURRENCY", "1")),
+    )
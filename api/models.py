@@ -1,5 +1,5 @@
 # models.py - Production ready для PostgreSQL на Render
-from sqlalchemy import Column, Integer, String, Float, Boolean, Text, DateTime, ForeignKey, JSON
+from sqlalchemy import Column, Integer, String, Float, Boolean, Text, DateTime, ForeignKey, Index, JSON
 from sqlalchemy.orm import relationship
 from sqlalchemy.sql import func
 from sqlalchemy.dialects.postgresql import ENUM
@@ -135,6 +135,32 @@ class Car(Base):
     category = relationship("Category", back_populates="cars")
     bookings = relationship("Booking", back_populates="car", cascade="all, delete-orphan")
     
+    __table_args__ = (
+        # Поиск по марке — префиксный LIKE по lower(brand); text_pattern_ops нужен PostgreSQL,
+        # чтобы B-tree индекс использовался для LIKE 'x%' при любой collation
+        Index(
+            "ix_cars_brand_lower",
+            func.lower(brand).label("brand_lower"),
+            postgresql_ops={"brand_lower": "text_pattern_ops"},
+        ),
+        # Фильтры /api/cars: активные машины по категории, статусу и цене.
+        # Условие совпадает с фильтром в get_cars (is_active = true): индекс сужает
+        # выборку и отдает строки в порядке цены. Index-only scan не получится —
+        # CarSummary читает и другие колонки (id, seats, images, ...), строки берутся из heap.
+        Index(
+            "ix_cars_hot",
+            category_id,
+            status,
+            daily_price,
+            postgresql_where=is_active == True,
+            postgresql_include=["brand", "model", "year", "thumbnail"],
+            sqlite_where=is_active == True,
+        ),
+        # /list_cars в боте: WHERE is_active = true ORDER BY id LIMIT n —
+        # range scan по индексу вместо сортировки всей таблицы
+        Index("ix_cars_active_id", is_active, id),
+    )
+    
     def __repr__(self):
         return f"<Car(id={self.id}, brand='{self.brand}', model='{self.model}', year={self.year})>"
     
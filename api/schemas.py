@@ -19,6 +19,8 @@ from pydantic import BaseModel, ConfigDict, Field, field_validator
 
 from .models import CarStatus, TransmissionType
 
+_EMAIL_RE = re.compile(r"^[a-zA-Z0-9._%+-]+@[a-zA-Z0-9.-]+\.[a-zA-Z]{2,}$")
+
 
 # =====================
 # CATEGORY
@@ -160,6 +162,25 @@ class CarDetail(Car):
     category: Optional[Category] = None
 
 
+class CarSummary(BaseModel):
+    """Карточка автомобиля для списка /api/cars — только то, что рендерит каталог."""
+
+    model_config = ConfigDict(from_attributes=True)
+
+    id: int
+    brand: str
+    model: str
+    year: int
+    category_id: Optional[int] = None
+    daily_price: float
+    seats: int
+    fuel_type: str
+    transmission: TransmissionType
+    status: Optional[CarStatus] = None
+    thumbnail: Optional[str] = None
+    images: Optional[List[str]] = None
+
+
 # =====================
 # BOOKINGS
 # =====================
@@ -177,7 +198,7 @@ class BookingBase(BaseModel):
     @field_validator("customer_email")
     @classmethod
     def validate_email(cls, v: str) -> str:
-        if not re.match(r"^[a-zA-Z0-9._%+-]+@[a-zA-Z0-9.-]+\.[a-zA-Z]{2,}$", v):
+        if not _EMAIL_RE.match(v):
             raise ValueError("Неверный формат email")
         return v
 
@@ -227,7 +248,7 @@ class UserBase(BaseModel):
     @field_validator("email")
     @classmethod
     def validate_email(cls, v: str) -> str:
-        if not re.match(r"^[a-zA-Z0-9._%+-]+@[a-zA-Z0-9.-]+\.[a-zA-Z]{2,}$", v):
+        if not _EMAIL_RE.match(v):
             raise ValueError("Неверный формат email")
         return v
 
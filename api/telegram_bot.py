@@ -4,34 +4,44 @@ telegram_bot.py - Telegram бот для AvtoRend (продакшен верси
 """
 
 import os
+import asyncio
 import logging
+import re
+import secrets
+import time
 import sys
 from datetime import datetime
+from decimal import Decimal, InvalidOperation
 from pathlib import Path
+from typing import Dict, List, Optional, Tuple
 import html
 
 # ========== НАСТРОЙКА ПУТЕЙ ==========
 current_dir = Path(__file__).parent.parent
 sys.path.insert(0, str(current_dir))
 
+# ========== ЗАГРУЗКА ПЕРЕМЕННЫХ ОКРУЖЕНИЯ ==========
+# .env читаем до настройки логов, чтобы LOG_LEVEL из него тоже применялся
+try:
+    from dotenv import load_dotenv
+    load_dotenv()
+    _dotenv_loaded = True
+except ImportError:
+    _dotenv_loaded = False
+
 # ========== НАСТРОЙКА ЛОГИРОВАНИЯ ==========
+# LOG_LEVEL=DEBUG включает подробную трассировку загрузки фото и сохранения машины
 logging.basicConfig(
     format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
-    level=logging.INFO
+    level=os.getenv("LOG_LEVEL", "INFO").upper()
 )
 logger = logging.getLogger(__name__)
 
-print("=" * 60)
-print("🤖 TELEGRAM BOT - AvtoRend Админ Панель (PRODUCTION)")
-print("=" * 60)
-
-# ========== ЗАГРУЗКА ПЕРЕМЕННЫХ ОКРУЖЕНИЯ ==========
-try:
-    from dotenv import load_dotenv
-    load_dotenv()
-    print("✅ .env файл загружен")
-except ImportError:
-    print("⚠️  python-dotenv не установлен, используем системные переменные")
+logger.info("🤖 TELEGRAM BOT - AvtoRend Админ Панель (PRODUCTION)")
+if _dotenv_loaded:
+    logger.info("✅ .env файл загружен")
+else:
+    logger.warning("⚠️  python-dotenv не установлен, используем системные переменные")
 
 # ========== ПРОВЕРКА КЛЮЧЕЙ CLOUDINARY (ОБЯЗАТЕЛЬНО) ==========
 CLOUDINARY_CLOUD_NAME = os.getenv("CLOUDINARY_CLOUD_NAME")
@@ -39,33 +49,33 @@ CLOUDINARY_API_KEY = os.getenv("CLOUDINARY_API_KEY")
 CLOUDINARY_API_SECRET = os.getenv("CLOUDINARY_API_SECRET")
 
 if not all([CLOUDINARY_CLOUD_NAME, CLOUDINARY_API_KEY, CLOUDINARY_API_SECRET]):
-    print("❌ ОШИБКА: Cloudinary ключи не настроены!")
-    print("ℹ️  Настройте в Environment Variables на Render:")
-    print("    CLOUDINARY_CLOUD_NAME")
-    print("    CLOUDINARY_API_KEY")
-    print("    CLOUDINARY_API_SECRET")
+    logger.error(
+        "❌ Cloudinary ключи не настроены! Задайте в Environment Variables на Render: "
+        "CLOUDINARY_CLOUD_NAME, CLOUDINARY_API_KEY, CLOUDINARY_API_SECRET"
+    )
     sys.exit(1)
 
-print(f"☁️  Cloudinary: {CLOUDINARY_CLOUD_NAME}")
-print(f"🔑 API Key: {CLOUDINARY_API_KEY[:8]}...")
+logger.info("☁️  Cloudinary: %s, API Key: %s...", CLOUDINARY_CLOUD_NAME, CLOUDINARY_API_KEY[:8])
 
 # ========== КОНФИГУРАЦИЯ ==========
 TOKEN = os.getenv("TELEGRAM_BOT_TOKEN")
-ADMIN_IDS = list(map(int, os.getenv("TELEGRAM_ADMIN_IDS", "").split(","))) if os.getenv("TELEGRAM_ADMIN_IDS") else []
+# frozenset: проверка прав — O(1) lookup на каждом апдейте
+ADMIN_IDS = frozenset(int(x) for x in os.getenv("TELEGRAM_ADMIN_IDS", "").split(",") if x.strip())
 
 if not TOKEN:
     logger.error("❌ TELEGRAM_BOT_TOKEN не найден!")
-    print("❌ ОШИБКА: TELEGRAM_BOT_TOKEN не установлен!")
     sys.exit(1)
 
-print(f"🔐 Токен: {TOKEN[:15]}...")
-print(f"👑 Админов: {len(ADMIN_IDS) if ADMIN_IDS else 'не настроено'}")
+logger.info("🔐 Токен: %s...", TOKEN[:15])
+logger.info("👑 Админов: %s", len(ADMIN_IDS) if ADMIN_IDS else 'не настроено')
 
 # ========== ИНИЦИАЛИЗАЦИЯ CLOUDINARY ==========
+# Только конфигурация: сетевую проверку (ping) делает post_init уже после старта бота
 try:
     import cloudinary
     import cloudinary.uploader
     import cloudinary.api
+    import cloudinary.utils
     
     cloudinary.config(
         cloud_name=CLOUDINARY_CLOUD_NAME,
@@ -73,51 +83,45 @@ try:
         api_secret=CLOUDINARY_API_SECRET,
         secure=True
     )
-    
-    # Проверка конфигурации Cloudinary
-    print("=" * 60)
-    print("🔍 Cloudinary Configuration Check:")
-    print(f"   CLOUDINARY_CLOUD_NAME env: '{CLOUDINARY_CLOUD_NAME}'")
-    print(f"   cloudinary.config().cloud_name: '{cloudinary.config().cloud_name}'")
-    print("=" * 60)
-    
-    # Проверяем подключение к Cloudinary
-    cloudinary.api.ping()
-    print("✅ Cloudinary подключен и работает")
-    
 except ImportError:
-    print("❌ Cloudinary не установлен. Установите: pip install cloudinary")
+    logger.error("❌ Cloudinary не установлен. Установите: pip install cloudinary")
     sys.exit(1)
-except Exception as e:
-    print(f"❌ Ошибка подключения к Cloudinary: {e}")
+
+# HTTP-клиент для загрузки фото в Cloudinary (ставится вместе с python-telegram-bot)
+try:
+    import httpx
+except ImportError:
+    logger.error("❌ httpx не установлен. Установите: pip install httpx")
     sys.exit(1)
 
 # ========== ИМПОРТЫ БАЗЫ ДАННЫХ ==========
 try:
-    from api.models import Car, Category, CarStatus, TransmissionType
-    from api.database import SessionLocal
+    from sqlalchemy import delete, func, select
+    from api.models import Booking, Car, Category, CarStatus, TransmissionType
+    from api.database import session_scope
     from api.schemas import CarCreate
-    print("✅ Модули БД импортированы")
 except ImportError as e:
-    print(f"❌ Ошибка импорта БД: {e}")
+    logger.error("❌ Ошибка импорта БД: %s", e)
     sys.exit(1)
 
 # ========== ИМПОРТЫ TELEGRAM ==========
 try:
-    from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup
+    from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup, PhotoSize
+    from telegram.request import HTTPXRequest
     from telegram.ext import (
+        AIORateLimiter,
         Application, 
         CommandHandler, 
         MessageHandler, 
         CallbackQueryHandler,
         ConversationHandler,
+        PersistenceInput,
+        PicklePersistence,
         filters,
         ContextTypes
     )
-    print("✅ Модули Telegram импортированы")
 except ImportError as e:
-    print(f"❌ Ошибка импорта Telegram: {e}")
-    print("ℹ️  Установите: pip install python-telegram-bot")
+    logger.error("❌ Ошибка импорта Telegram: %s. Установите: pip install python-telegram-bot", e)
     sys.exit(1)
 
 # ========== СОСТОЯНИЯ ДЛЯ ConversationHandler ==========
@@ -128,8 +132,137 @@ except ImportError as e:
     DEPOSIT, MILEAGE, FEATURES, DESCRIPTION, PHOTOS, CONFIRM
 ) = range(20)
 
-# ========== ВРЕМЕННОЕ ХРАНИЛИЩЕ ДАННЫХ ==========
-user_data_store = {}
+# ========== СТАТИЧЕСКИЕ КЛАВИАТУРЫ ==========
+# Неизменяемые клавиатуры собираем один раз при загрузке модуля
+TRANSMISSION_BY_CALLBACK = {
+    "trans_automatic": TransmissionType.AUTOMATIC,
+    "trans_manual": TransmissionType.MANUAL,
+    "trans_cvt": TransmissionType.CVT,
+    "trans_semi_automatic": TransmissionType.SEMI_AUTOMATIC,
+}
+
+TRANSMISSION_KEYBOARD = InlineKeyboardMarkup([
+    [InlineKeyboardButton("Автомат", callback_data="trans_automatic")],
+    [InlineKeyboardButton("Механика", callback_data="trans_manual")],
+    [InlineKeyboardButton("Вариатор", callback_data="trans_cvt")],
+    [InlineKeyboardButton("Робот", callback_data="trans_semi_automatic")],
+])
+
+CONFIRM_KEYBOARD = InlineKeyboardMarkup([
+    [InlineKeyboardButton("✅ Сохранить в БД", callback_data="confirm_save")],
+    [InlineKeyboardButton("❌ Отменить", callback_data="confirm_cancel")]
+])
+
+# ========== ДОСТУП К БД ==========
+# Команды вне /add_car обрабатываются параллельно (block=False), поэтому число
+# одновременных запросов к БД ограничиваем — не больше DB_POOL_SIZE
+DB_CONCURRENCY = int(os.getenv("BOT_DB_CONCURRENCY", "10"))
+_db_semaphore = asyncio.Semaphore(DB_CONCURRENCY)
+
+async def run_db(func, *args):
+    """Синхронная работа с БД в пуле потоков, не больше DB_CONCURRENCY одновременно"""
+    async with _db_semaphore:
+        return await asyncio.to_thread(func, *args)
+
+# ========== КЭШ КАТЕГОРИЙ ==========
+# Категории меняются редко, а /add_car читает их дважды за диалог
+CATEGORIES_CACHE_TTL = float(os.getenv("BOT_CATEGORIES_CACHE_TTL", "60"))
+_categories_cache: Optional[Tuple[float, List[Tuple[int, str]]]] = None
+
+def _load_active_categories() -> List[Tuple[int, str]]:
+    with session_scope() as db:
+        rows = db.query(Category.id, Category.name).filter(Category.is_active == True).all()
+    return [(row.id, row.name) for row in rows]
+
+async def get_active_categories() -> List[Tuple[int, str]]:
+    """(id, name) активных категорий; читаем из БД не чаще раза в CATEGORIES_CACHE_TTL"""
+    global _categories_cache
+    if _categories_cache is not None and time.monotonic() - _categories_cache[0] < CATEGORIES_CACHE_TTL:
+        return _categories_cache[1]
+    
+    categories = await run_db(_load_active_categories)
+    _categories_cache = (time.monotonic(), categories)
+    return categories
+
+async def get_category_names() -> Dict[int, str]:
+    return dict(await get_active_categories())
+
+# ========== ФОНОВАЯ ЗАГРУЗКА ФОТО ==========
+# Сколько фото одновременно грузим в Cloudinary (на весь процесс бота)
+UPLOAD_CONCURRENCY = int(os.getenv("BOT_UPLOAD_CONCURRENCY", "8"))
+_upload_semaphore = asyncio.Semaphore(UPLOAD_CONCURRENCY)
+
+# Сколько раз повторяем загрузку после сетевой ошибки, 429 или 5xx
+CLOUDINARY_MAX_RETRIES = int(os.getenv("CLOUDINARY_MAX_RETRIES", "3"))
+
+# Подпись загрузки живет час (по timestamp); переподписываем с запасом
+UPLOAD_SIGNATURE_TTL = 50 * 60
+
+# Лимит фото на одну машину: ограничивает и список URL, и число фоновых задач в диалоге
+MAX_PHOTOS_PER_CAR = int(os.getenv("BOT_MAX_PHOTOS_PER_CAR", "20"))
+
+# Черновики /add_car (context.user_data) и текущий шаг диалога переживают перезапуск бота:
+# PicklePersistence пишет их в этот файл. Фоновые задачи загрузки не сериализуются —
+# см. PendingUploads
+BOT_STATE_FILE = os.getenv("BOT_STATE_FILE", "bot_state.pickle")
+
+class PendingUploads(list):
+    """Фоновые задачи загрузки фото пользователя (user_data["uploads"]).
+    
+    Задачи живут только в памяти процесса: PTB делает deepcopy user_data перед записью
+    в PicklePersistence, а asyncio.Task не копируется и не сериализуется. Поэтому копия
+    и pickle — пустой список; после перезапуска незавершенные загрузки теряются.
+    """
+    
+    def __deepcopy__(self, memo):
+        return PendingUploads()
+    
+    def __reduce__(self):
+        return (PendingUploads, ())
+
+# Исходящие запросы к Bot API (reply_text, edit_message_text, ...) проходят через
+# token bucket AIORateLimiter. Лимит Telegram — 30 сообщений/с на бота; держим запас,
+# чтобы при всплеске не ловить 429 и flood wait
+TELEGRAM_MAX_RATE = float(os.getenv("BOT_TELEGRAM_MAX_RATE", "28"))
+
+# Производные версии фото (например "c_fill,w_400|c_fill,h_600,w_800") Cloudinary строит
+# в фоне (eager_async) — ответ на загрузку не ждет трансформаций
+CLOUDINARY_EAGER = os.getenv("CLOUDINARY_EAGER", "").strip()
+CLOUDINARY_EAGER_NOTIFICATION_URL = os.getenv("CLOUDINARY_EAGER_NOTIFICATION_URL", "").strip() or None
+
+# Общий keep-alive клиент к Upload API: TLS-рукопожатие один раз на соединение, а не на каждое фото
+_cloudinary_http: Optional[httpx.AsyncClient] = None
+
+def _get_cloudinary_http() -> httpx.AsyncClient:
+    global _cloudinary_http
+    if _cloudinary_http is None:
+        _cloudinary_http = httpx.AsyncClient(
+            timeout=30,
+            limits=httpx.Limits(
+                max_connections=UPLOAD_CONCURRENCY,
+                max_keepalive_connections=UPLOAD_CONCURRENCY,
+                keepalive_expiry=75
+            )
+        )
+    return _cloudinary_http
+
+async def _verify_cloudinary(application: Application) -> None:
+    """post_init: проверяем Cloudinary в фоне, не задерживая прием апдейтов"""
+    async def ping() -> None:
+        try:
+            await asyncio.to_thread(cloudinary.api.ping)
+            logger.info("✅ Cloudinary подключен и работает")
+        except Exception as e:
+            logger.error("❌ Ошибка подключения к Cloudinary: %s", e)
+    
+    application.bot_data["cloudinary_ping"] = asyncio.create_task(ping())
+
+async def _close_cloudinary_http(application: Application) -> None:
+    """post_shutdown: закрываем соединения с Cloudinary"""
+    global _cloudinary_http
+    if _cloudinary_http is not None:
+        await _cloudinary_http.aclose()
+        _cloudinary_http = None
 
 # ========== ДЕКОРАТОРЫ ==========
 def admin_only(func):
@@ -146,15 +279,14 @@ def admin_only(func):
     return wrapper
 
 # ========== ВСПОМОГАТЕЛЬНЫЕ ФУНКЦИИ ==========
+# Таблица экранирования строится один раз: str.translate делает один проход по строке
+_MD_ESCAPE_TABLE = str.maketrans({char: f'\\{char}' for char in r'_*[]()~`>#+-=|{}.!'})
+
 def escape_markdown(text: str) -> str:
     """Экранирует специальные символы Markdown"""
     if not text:
         return text
-    # Экранируем символы, которые могут сломать Markdown
-    escape_chars = r'_*[]()~`>#+-=|{}.!'
-    for char in escape_chars:
-        text = text.replace(char, f'\\{char}')
-    return text
+    return text.translate(_MD_ESCAPE_TABLE)
 
 # ========== ОТЛАДОЧНАЯ КОМАНДА ==========
 async def debug(update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -166,7 +298,7 @@ async def debug(update: Update, context: ContextTypes.DEFAULT_TYPE):
         f"🔧 *Отладка бота*\n\n"
         f"👤 Ваш ID: `{user_id}`\n"
         f"📛 Username: @{username}\n"
-        f"📋 ADMIN_IDS: `{ADMIN_IDS}`\n"
+        f"📋 ADMIN_IDS: `{sorted(ADMIN_IDS)}`\n"
         f"🔍 В списке админов: **{'✅ ДА' if user_id in ADMIN_IDS else '❌ НЕТ'}**\n\n"
         f"☁️  Cloudinary: {CLOUDINARY_CLOUD_NAME}\n"
         f"📦 Хранилище: **ТОЛЬКО CLOUDINARY**\n\n"
@@ -199,13 +331,14 @@ async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
         parse_mode='Markdown'
     )
 
+def _count_cars_and_categories() -> Tuple[int, int]:
+    with session_scope() as db:
+        return db.query(Car).count(), db.query(Category).count()
+
 async def admin_status(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Статус системы для администратора"""
     try:
-        db = SessionLocal()
-        cars_count = db.query(Car).count()
-        categories_count = db.query(Category).count()
-        db.close()
+        cars_count, categories_count = await run_db(_count_cars_and_categories)
         
         db_status = "✅ Подключена"
     except Exception as e:
@@ -227,48 +360,90 @@ async def admin_status(update: Update, context: ContextTypes.DEFAULT_TYPE):
     
     await update.message.reply_text(status_text, parse_mode='Markdown')
 
+# ========== КЛАССИФИКАЦИЯ URL ФОТО ==========
+# Одна регулярка на все проверки; порядок альтернатив = приоритет (Cloudinary-URL тоже начинается с https)
+_IMG_RE = re.compile(r"^(?:(?=.*?(cloudinary\.com))|(?=.*?(/static/uploads/))|(?=(https?://)))")
+IMG_UNKNOWN, IMG_CLOUDINARY, IMG_LOCAL, IMG_URL = range(4)
+_IMG_LABELS = ("❓ Неизвестный", "✅ Cloudinary", "❌ Локальный", "🌐 Другой URL")
+
+def image_kind(url: str) -> int:
+    """Тип фото по URL: IMG_CLOUDINARY / IMG_LOCAL / IMG_URL / IMG_UNKNOWN"""
+    m = _IMG_RE.match(url)
+    return m.lastindex if m else IMG_UNKNOWN
+
+def is_cloudinary_url(url: str) -> bool:
+    return image_kind(url) == IMG_CLOUDINARY
+
 # ========== КОМАНДА ПРОВЕРКИ ФОТО ==========
+# Лимит одного сообщения в Telegram — 4096 символов, оставляем запас под разметку
+CHECK_PHOTOS_CHUNK_CHARS = 3500
+
+def _all_cars() -> List[Car]:
+    with session_scope() as db:
+        return db.query(Car).order_by(Car.id).all()
+
 async def check_photos(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Проверить пути к фото в БД"""
     try:
-        db = SessionLocal()
-        cars = db.query(Car).order_by(Car.id).all()
+        # Запрос в отдельном потоке; сессия закрывается до отправки сообщений
+        cars = await run_db(_all_cars)
         
         if not cars:
             await update.message.reply_text("🚫 В базе нет автомобилей.")
-            db.close()
             return
         
+        # Копим карточки и отправляем пачками: одно сообщение на ~20 машин вместо одного на каждую
+        buf = []
+        buf_len = 0
         for car in cars:
-            photos_info = []
-            for i, img in enumerate(car.images or []):
-                if 'cloudinary.com' in img:
-                    photos_info.append(f"✅ Cloudinary {i+1}")
-                elif '/static/uploads/' in img:
-                    photos_info.append(f"❌ Локальный {i+1}")
-                elif img.startswith('http'):
-                    photos_info.append(f"🌐 Другой URL {i+1}")
-                else:
-                    photos_info.append(f"❓ Неизвестный {i+1}")
+            photos_info = [f"{_IMG_LABELS[image_kind(img)]} {i+1}" for i, img in enumerate(car.images or [])]
             
             sample_url = car.images[0][:100] + "..." if car.images and len(car.images[0]) > 100 else car.images[0] if car.images else "Нет фото"
             
-            await update.message.reply_text(
+            block = (
                 f"🚗 *{car.brand} {car.model} (ID: {car.id})*\n"
-                f"📸 Фото: {len(car.images)} шт. - {', '.join(photos_info) if photos_info else 'Нет'}\n"
-                f"🔗 Пример: `{sample_url}`",
-                parse_mode='Markdown'
+                f"📸 Фото: {len(car.images or [])} шт. - {', '.join(photos_info) if photos_info else 'Нет'}\n"
+                f"🔗 Пример: `{sample_url}`"
             )
+            if buf and buf_len + len(block) + 2 > CHECK_PHOTOS_CHUNK_CHARS:
+                await update.message.reply_text("\n\n".join(buf), parse_mode='Markdown')
+                buf = []
+                buf_len = 0
+            buf.append(block)
+            buf_len += len(block) + 2
         
-        db.close()
+        if buf:
+            await update.message.reply_text("\n\n".join(buf), parse_mode='Markdown')
     except Exception as e:
         await update.message.reply_text(f"❌ Ошибка проверки фото: {str(e)[:200]}")
 
 # ========== ДОБАВЛЕНИЕ АВТОМОБИЛЯ ==========
+def _cancel_uploads(user_data: dict) -> List[str]:
+    """Отменяет незавершенные загрузки; возвращает URL фото, которые уже успели загрузиться"""
+    uploaded = []
+    for task in user_data.pop("uploads", None) or []:
+        if not task.done():
+            task.cancel()
+        elif not task.cancelled() and task.exception() is None:
+            uploaded.append(task.result())
+    return uploaded
+
+async def _discard_draft(user_data: dict) -> None:
+    """Бросает черновик /add_car: отменяет загрузки и удаляет уже загруженные фото из Cloudinary"""
+    urls = _cancel_uploads(user_data) + list(user_data.get("photos") or [])
+    user_data.clear()
+    public_ids = [pid for pid in map(cloudinary_public_id, urls) if pid]
+    if public_ids:
+        deleted = await _delete_cloudinary_images(public_ids)
+        logger.info("Черновик отменен, удалено фото из Cloudinary: %s", deleted)
+
 async def add_car(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Начать процесс добавления машины"""
-    user_id = update.effective_user.id
-    user_data_store[user_id] = {"photos": []}
+    # Черновик машины живет в context.user_data (PTB хранит его per-user) и очищается в конце диалога.
+    # Папка фото в Cloudinary: случайный префикс на весь диалог, без коллизий между админами
+    _cancel_uploads(context.user_data)
+    context.user_data.clear()
+    context.user_data.update(photos=[], uploads=PendingUploads(), cloudinary_prefix=secrets.token_hex(8))
     
     await update.message.reply_text(
         "🚗 *Добавление нового автомобиля (Cloudinary)*\n\n"
@@ -279,56 +454,76 @@ async def add_car(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
 async def process_brand(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Обработка марки"""
-    user_id = update.effective_user.id
-    user_data_store[user_id]["brand"] = update.message.text
+    context.user_data["brand"] = update.message.text
     
     await update.message.reply_text("Введите модель (например: Camry):")
     return MODEL
 
 async def process_model(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Обработка модели"""
-    user_id = update.effective_user.id
-    user_data_store[user_id]["model"] = update.message.text
+    context.user_data["model"] = update.message.text
     
     await update.message.reply_text("Введите год выпуска (например: 2023):")
     return YEAR
 
-async def process_year(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    """Обработка года"""
+_KOPECKS = Decimal("0.01")
+
+def parse_money(text: str) -> Decimal:
+    """Денежная сумма из текста ("2500", "2 500,50") — Decimal до копеек, без двоичного округления float"""
+    text = text.strip().replace(" ", "")
+    if "," in text:
+        text = text.replace(",", ".")
     try:
-        year = int(update.message.text)
-        if year < 1900 or year > datetime.now().year + 1:
-            raise ValueError
-    except ValueError:
-        await update.message.reply_text("Пожалуйста, введите корректный год (например: 2023):")
-        return YEAR
-    
-    user_id = update.effective_user.id
-    user_data_store[user_id]["year"] = year
+        value = Decimal(text)
+        if value.is_finite():
+            return value.quantize(_KOPECKS)
+    except InvalidOperation:
+        pass
+    raise ValueError(f"Некорректная сумма: {text!r}")
+
+def make_numeric_handler(field, caster, is_valid, state, next_state, error_text, next_prompt):
+    """Обработчик числового шага диалога: парсит, проверяет диапазон, сохраняет в user_data"""
+    async def handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
+        try:
+            text = update.message.text.strip()
+            value = caster(text.replace(",", ".") if "," in text else text)
+            if not is_valid(value):
+                raise ValueError
+        except ValueError:
+            await update.message.reply_text(error_text)
+            return state
+        
+        context.user_data[field] = value
+        
+        await update.message.reply_text(next_prompt)
+        return next_state
     
-    await update.message.reply_text("Введите номерной знак (например: A123BC):")
-    return LICENSE_PLATE
+    handler.__name__ = handler.__qualname__ = f"process_{field}"
+    return handler
+
+process_year = make_numeric_handler(
+    "year", int, lambda v: 1900 <= v <= datetime.now().year + 1, YEAR, LICENSE_PLATE,
+    "Пожалуйста, введите корректный год (например: 2023):",
+    "Введите номерной знак (например: A123BC):"
+)
 
 async def process_license_plate(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Обработка номера"""
-    user_id = update.effective_user.id
-    user_data_store[user_id]["license_plate"] = update.message.text.upper()
+    context.user_data["license_plate"] = update.message.text.upper()
     
     # Показываем доступные категории
     try:
-        db = SessionLocal()
-        categories = db.query(Category).filter(Category.is_active == True).all()
-        db.close()
+        categories = await get_active_categories()
         
         if not categories:
             await update.message.reply_text("❌ Нет доступных категорий.")
             return ConversationHandler.END
         
         keyboard = []
-        for category in categories:
+        for category_id, category_name in categories:
             keyboard.append([InlineKeyboardButton(
-                f"{category.name} (ID: {category.id})", 
-                callback_data=f"cat_{category.id}"
+                f"{category_name} (ID: {category_id})", 
+                callback_data=f"cat_{category_id}"
             )])
         
         await update.message.reply_text(
@@ -337,7 +532,7 @@ async def process_license_plate(update: Update, context: ContextTypes.DEFAULT_TY
         )
         return CATEGORY_ID
     except Exception as e:
-        logger.error(f"Ошибка при получении категорий: {e}")
+        logger.error("Ошибка при получении категорий: %s", e)
         await update.message.reply_text("❌ Ошибка при загрузке категорий.")
         return ConversationHandler.END
 
@@ -347,68 +542,35 @@ async def process_category(update: Update, context: ContextTypes.DEFAULT_TYPE):
     await query.answer()
     
     category_id = int(query.data.split("_")[1])
-    user_id = query.from_user.id
-    user_data_store[user_id]["category_id"] = category_id
+    context.user_data["category_id"] = category_id
     
     try:
-        db = SessionLocal()
-        category = db.query(Category).filter(Category.id == category_id).first()
-        db.close()
-        
-        category_name = category.name if category else f"ID: {category_id}"
+        category_name = (await get_category_names()).get(category_id, f"ID: {category_id}")
         await query.edit_message_text(f"✅ Категория: {category_name}\n\nВведите объем двигателя в литрах (например: 2.0):")
         return ENGINE_CAPACITY
     except Exception as e:
         await query.edit_message_text("❌ Ошибка при загрузке категории.")
         return ConversationHandler.END
 
-async def process_engine_capacity(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    """Обработка объема двигателя"""
-    try:
-        capacity = float(update.message.text.replace(",", "."))
-        if capacity <= 0:
-            raise ValueError
-    except ValueError:
-        await update.message.reply_text("Пожалуйста, введите корректный объем (например: 2.0):")
-        return ENGINE_CAPACITY
-    
-    user_id = update.effective_user.id
-    user_data_store[user_id]["engine_capacity"] = capacity
-    
-    await update.message.reply_text("Введите мощность в л.с. (например: 150):")
-    return HORSEPOWER
+process_engine_capacity = make_numeric_handler(
+    "engine_capacity", float, lambda v: v > 0, ENGINE_CAPACITY, HORSEPOWER,
+    "Пожалуйста, введите корректный объем (например: 2.0):",
+    "Введите мощность в л.с. (например: 150):"
+)
 
-async def process_horsepower(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    """Обработка мощности"""
-    try:
-        hp = int(update.message.text)
-        if hp <= 0:
-            raise ValueError
-    except ValueError:
-        await update.message.reply_text("Пожалуйста, введите корректную мощность (например: 150):")
-        return HORSEPOWER
-    
-    user_id = update.effective_user.id
-    user_data_store[user_id]["horsepower"] = hp
-    
-    await update.message.reply_text("Введите тип топлива (бензин, дизель, электрокар, гибрид):")
-    return FUEL_TYPE
+process_horsepower = make_numeric_handler(
+    "horsepower", int, lambda v: v > 0, HORSEPOWER, FUEL_TYPE,
+    "Пожалуйста, введите корректную мощность (например: 150):",
+    "Введите тип топлива (бензин, дизель, электрокар, гибрид):"
+)
 
 async def process_fuel_type(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Обработка типа топлива"""
-    user_id = update.effective_user.id
-    user_data_store[user_id]["fuel_type"] = update.message.text
-    
-    keyboard = [
-        [InlineKeyboardButton("Автомат", callback_data="trans_automatic")],
-        [InlineKeyboardButton("Механика", callback_data="trans_manual")],
-        [InlineKeyboardButton("Вариатор", callback_data="trans_cvt")],
-        [InlineKeyboardButton("Робот", callback_data="trans_semi_automatic")],
-    ]
+    context.user_data["fuel_type"] = update.message.text
     
     await update.message.reply_text(
         "Выберите тип трансмиссии:",
-        reply_markup=InlineKeyboardMarkup(keyboard)
+        reply_markup=TRANSMISSION_KEYBOARD
     )
     return TRANSMISSION
 
@@ -417,129 +579,58 @@ async def process_transmission(update: Update, context: ContextTypes.DEFAULT_TYP
     query = update.callback_query
     await query.answer()
     
-    trans_map = {
-        "trans_automatic": TransmissionType.AUTOMATIC,
-        "trans_manual": TransmissionType.MANUAL,
-        "trans_cvt": TransmissionType.CVT,
-        "trans_semi_automatic": TransmissionType.SEMI_AUTOMATIC,
-    }
-    
-    user_id = query.from_user.id
-    user_data_store[user_id]["transmission"] = trans_map[query.data]
+    transmission = TRANSMISSION_BY_CALLBACK[query.data]
+    context.user_data["transmission"] = transmission
     
-    await query.edit_message_text(f"✅ Трансмиссия: {trans_map[query.data].value}\n\nВведите расход топлива (л/100км, например: 8.5):")
+    await query.edit_message_text(f"✅ Трансмиссия: {transmission.value}\n\nВведите расход топлива (л/100км, например: 8.5):")
     return FUEL_CONSUMPTION
 
-async def process_fuel_consumption(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    """Обработка расхода"""
-    try:
-        consumption = float(update.message.text.replace(",", "."))
-        if consumption <= 0:
-            raise ValueError
-    except ValueError:
-        await update.message.reply_text("Пожалуйста, введите корректный расход (например: 8.5):")
-        return FUEL_CONSUMPTION
-    
-    user_id = update.effective_user.id
-    user_data_store[user_id]["fuel_consumption"] = consumption
-    
-    await update.message.reply_text("Введите количество дверей (например: 4):")
-    return DOORS
+process_fuel_consumption = make_numeric_handler(
+    "fuel_consumption", float, lambda v: v > 0, FUEL_CONSUMPTION, DOORS,
+    "Пожалуйста, введите корректный расход (например: 8.5):",
+    "Введите количество дверей (например: 4):"
+)
 
-async def process_doors(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    """Обработка количества дверей"""
-    try:
-        doors = int(update.message.text)
-        if doors <= 0:
-            raise ValueError
-    except ValueError:
-        await update.message.reply_text("Пожалуйста, введите корректное количество дверей (например: 4):")
-        return DOORS
-    
-    user_id = update.effective_user.id
-    user_data_store[user_id]["doors"] = doors
-    
-    await update.message.reply_text("Введите количество мест (например: 5):")
-    return SEATS
+process_doors = make_numeric_handler(
+    "doors", int, lambda v: v > 0, DOORS, SEATS,
+    "Пожалуйста, введите корректное количество дверей (например: 4):",
+    "Введите количество мест (например: 5):"
+)
 
-async def process_seats(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    """Обработка количества мест"""
-    try:
-        seats = int(update.message.text)
-        if seats <= 0:
-            raise ValueError
-    except ValueError:
-        await update.message.reply_text("Пожалуйста, введите корректное количество мест (например: 5):")
-        return SEATS
-    
-    user_id = update.effective_user.id
-    user_data_store[user_id]["seats"] = seats
-    
-    await update.message.reply_text("Введите цвет автомобиля (например: Черный):")
-    return COLOR
+process_seats = make_numeric_handler(
+    "seats", int, lambda v: v > 0, SEATS, COLOR,
+    "Пожалуйста, введите корректное количество мест (например: 5):",
+    "Введите цвет автомобиля (например: Черный):"
+)
 
 async def process_color(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Обработка цвета"""
-    user_id = update.effective_user.id
-    user_data_store[user_id]["color"] = update.message.text
+    context.user_data["color"] = update.message.text
     
     await update.message.reply_text("Введите цену за день (например: 2500):")
     return DAILY_PRICE
 
-async def process_daily_price(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    """Обработка цены"""
-    try:
-        price = float(update.message.text.replace(",", "."))
-        if price <= 0:
-            raise ValueError
-    except ValueError:
-        await update.message.reply_text("Пожалуйста, введите корректную цену (например: 2500):")
-        return DAILY_PRICE
-    
-    user_id = update.effective_user.id
-    user_data_store[user_id]["daily_price"] = price
-    
-    await update.message.reply_text("Введите сумму залога (например: 10000):")
-    return DEPOSIT
+process_daily_price = make_numeric_handler(
+    "daily_price", parse_money, lambda v: v > 0, DAILY_PRICE, DEPOSIT,
+    "Пожалуйста, введите корректную цену (например: 2500):",
+    "Введите сумму залога (например: 10000):"
+)
 
-async def process_deposit(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    """Обработка залога"""
-    try:
-        deposit = float(update.message.text.replace(",", "."))
-        if deposit < 0:
-            raise ValueError
-    except ValueError:
-        await update.message.reply_text("Пожалуйста, введите корректную сумму залога (например: 10000):")
-        return DEPOSIT
-    
-    user_id = update.effective_user.id
-    user_data_store[user_id]["deposit"] = deposit
-    
-    await update.message.reply_text("Введите текущий пробег в км (например: 15000):")
-    return MILEAGE
+process_deposit = make_numeric_handler(
+    "deposit", parse_money, lambda v: v >= 0, DEPOSIT, MILEAGE,
+    "Пожалуйста, введите корректную сумму залога (например: 10000):",
+    "Введите текущий пробег в км (например: 15000):"
+)
 
-async def process_mileage(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    """Обработка пробега"""
-    try:
-        mileage = int(update.message.text)
-        if mileage < 0:
-            raise ValueError
-    except ValueError:
-        await update.message.reply_text("Пожалуйста, введите корректный пробег (например: 15000):")
-        return MILEAGE
-    
-    user_id = update.effective_user.id
-    user_data_store[user_id]["mileage"] = mileage
-    
-    await update.message.reply_text(
-        "Введите опции через запятую (например: кондиционер, подогрев сидений):\n"
-        "Или отправьте 'нет', если опций нет:"
-    )
-    return FEATURES
+process_mileage = make_numeric_handler(
+    "mileage", int, lambda v: v >= 0, MILEAGE, FEATURES,
+    "Пожалуйста, введите корректный пробег (например: 15000):",
+    "Введите опции через запятую (например: кондиционер, подогрев сидений):\n"
+    "Или отправьте 'нет', если опций нет:"
+)
 
 async def process_features(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Обработка опций"""
-    user_id = update.effective_user.id
     text = update.message.text.strip()
     
     if text.lower() == 'нет':
@@ -547,14 +638,13 @@ async def process_features(update: Update, context: ContextTypes.DEFAULT_TYPE):
     else:
         features = [f.strip() for f in text.split(",")]
     
-    user_data_store[user_id]["features"] = features
+    context.user_data["features"] = features
     
     await update.message.reply_text("Введите описание автомобиля (или отправьте 'нет' для пропуска):")
     return DESCRIPTION
 
 async def process_description(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Обработка описания"""
-    user_id = update.effective_user.id
     text = update.message.text.strip()
     
     if text.lower() == 'нет':
@@ -562,7 +652,7 @@ async def process_description(update: Update, context: ContextTypes.DEFAULT_TYPE
     else:
         description = text
     
-    user_data_store[user_id]["description"] = description
+    context.user_data["description"] = description
     
     await update.message.reply_text(
         "📸 *Отправьте фотографии автомобиля (можно несколько).*\n"
@@ -573,128 +663,157 @@ async def process_description(update: Update, context: ContextTypes.DEFAULT_TYPE
     )
     return PHOTOS
 
+def _sign_folder_upload(folder: str) -> dict:
+    """Подписанные поля Upload API для всех фото одной машины (те же параметры, что у cloudinary.uploader.upload).
+    
+    public_id не подписываем: его задает имя файла в multipart (use_filename, без уникального суффикса),
+    поэтому одна подпись годится для всех загрузок в папку.
+    """
+    options = {
+        "folder": folder,
+        "use_filename": True,
+        "unique_filename": False,
+        "overwrite": False,
+        "resource_type": "image",
+    }
+    if CLOUDINARY_EAGER:
+        options.update(
+            eager=CLOUDINARY_EAGER,
+            eager_async=True,
+            eager_notification_url=CLOUDINARY_EAGER_NOTIFICATION_URL
+        )
+    params = cloudinary.utils.build_upload_params(**options)
+    params = cloudinary.utils.sign_request(params, {})
+    return {k: v for k, v in params.items() if v}
+
+async def _cloudinary_upload(data: bytes, filename: str, form: dict) -> dict:
+    """Загрузка в Upload API напрямую через общий keep-alive клиент"""
+    url = cloudinary.utils.cloudinary_api_url("upload", resource_type="image")
+    
+    # Сетевые сбои, 429 и 5xx повторяем с экспоненциальной паузой; overwrite=False делает повтор безопасным
+    for attempt in range(CLOUDINARY_MAX_RETRIES + 1):
+        try:
+            response = await _get_cloudinary_http().post(url, data=form, files={"file": (filename, data)})
+        except httpx.TransportError as e:
+            if attempt == CLOUDINARY_MAX_RETRIES:
+                raise
+            delay = min(30, 2 ** attempt)
+            logger.warning("⚠️ Cloudinary недоступен (%r), повтор через %s с", e, delay)
+        else:
+            if (response.status_code != 429 and response.status_code < 500) or attempt == CLOUDINARY_MAX_RETRIES:
+                break
+            retry_after = response.headers.get("Retry-After", "")
+            delay = min(30, int(retry_after) if retry_after.isdigit() else 2 ** attempt)
+            logger.warning("⚠️ Cloudinary ответил %s, повтор через %s с", response.status_code, delay)
+        await asyncio.sleep(delay)
+    
+    try:
+        result = response.json()
+    except ValueError:
+        result = {}
+    if response.status_code != 200 or "error" in result:
+        message = result.get("error", {}).get("message") or response.text[:200]
+        raise ValueError(f"Cloudinary {response.status_code}: {message}")
+    return result
+
+async def _upload_to_cloudinary(data: bytes, filename: str, form: dict) -> str:
+    """Загрузка одного фото в Cloudinary, не больше UPLOAD_CONCURRENCY одновременно"""
+    async with _upload_semaphore:
+        logger.debug("🔍 Загрузка в Cloudinary: %s/%s (%d байт)", form.get("folder"), filename, len(data))
+        result = await _cloudinary_upload(data, filename, form)
+    
+    cloudinary_url = result.get('secure_url')
+    if not cloudinary_url:
+        raise ValueError("Cloudinary не вернул URL")
+    
+    logger.debug("✅ Cloudinary загрузка успешна: %.100s...", cloudinary_url)
+    return cloudinary_url
+
+async def _fetch_and_upload(photo: PhotoSize, filename: str, form: dict) -> str:
+    """getFile + скачивание в память + загрузка в Cloudinary — целиком в фоновой задаче"""
+    photo_file = await photo.get_file()
+    # Скачиваем фото в память — без временных файлов на диске
+    data = bytes(await photo_file.download_as_bytearray())
+    return await _upload_to_cloudinary(data, filename, form)
+
 async def process_photo(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    """Обработка загрузки фото - ТОЛЬКО Cloudinary"""
-    user_id = update.effective_user.id
+    """Прием фото: скачивание и загрузку в Cloudinary ставим в фон, отвечаем сразу"""
+    context.user_data.setdefault("photos", [])
+    uploads = context.user_data.setdefault("uploads", PendingUploads())
     
-    if "photos" not in user_data_store.get(user_id, {}):
-        user_data_store[user_id] = {"photos": []}
+    if len(context.user_data["photos"]) + len(uploads) >= MAX_PHOTOS_PER_CAR:
+        await update.message.reply_text(
+            f"⚠️ Максимум {MAX_PHOTOS_PER_CAR} фото на автомобиль. Отправьте /done для продолжения"
+        )
+        return PHOTOS
     
     try:
-        photo_file = await update.message.photo[-1].get_file()
-        
-        # Создаем временный файл
-        timestamp = datetime.now().strftime("%Y%m%d_%H%M%S_%f")
-        temp_filename = f"temp_{user_id}_{timestamp}.jpg"
+        prefix = context.user_data.setdefault("cloudinary_prefix", secrets.token_hex(8))
+        # Сквозной номер в рамках диалога: неудачные загрузки не дают повторить public_id
+        photo_index = context.user_data["photo_seq"] = context.user_data.get("photo_seq", 0) + 1
         
-        # Создаем временную директорию
-        temp_dir = Path("temp_uploads")
-        temp_dir.mkdir(exist_ok=True)
-        temp_path = temp_dir / temp_filename
+        # Одна подпись на все фото машины; обновляем, пока Cloudinary еще принимает timestamp
+        signed = context.user_data.get("upload_signature")
+        if signed is None or time.time() - signed[0] > UPLOAD_SIGNATURE_TTL:
+            signed = (time.time(), _sign_folder_upload(f"avtorend/car_{prefix}"))
+            context.user_data["upload_signature"] = signed
         
-        # Скачиваем фото
-        await photo_file.download_to_drive(temp_path)
+        # Ни одного запроса к Telegram до ответа: getFile и скачивание идут в фоне, результаты собираем в /done
+        uploads.append(asyncio.create_task(
+            _fetch_and_upload(update.message.photo[-1], f"photo_{photo_index}.jpg", signed[1])
+        ))
         
-        # Получаем car_id для папки в Cloudinary
-        car_id = user_data_store[user_id].get("temp_car_id", 0)
-        if car_id == 0:
-            # Генерируем временный ID для папки в Cloudinary
-            car_id = int(datetime.now().timestamp()) % 1000000
-            user_data_store[user_id]["temp_car_id"] = car_id
-        
-        # ========== ЗАГРУЗКА В CLOUDINARY ==========
-        try:
-            # ✅ ВАЖНО: Используем правильный формат public_id с расширением
-            photo_index = len(user_data_store[user_id]['photos']) + 1
-            public_id = f"avtorend/car_{car_id}/photo_{timestamp}_{photo_index}"
-            
-            print(f"🔍 Загрузка в Cloudinary...")
-            print(f"   Public ID: {public_id}")
-            print(f"   Файл: {temp_path}")
-            print(f"   Размер: {temp_path.stat().st_size} байт")
-            
-            # Загружаем фото в Cloudinary с правильными параметрами
-            result = cloudinary.uploader.upload(
-                str(temp_path),
-                public_id=public_id,
-                overwrite=False,
-                resource_type="image",
-                timeout=30
-            )
-            
-            cloudinary_url = result.get('secure_url')
-            
-            if not cloudinary_url:
-                raise ValueError("Cloudinary не вернул URL")
-            
-            # Проверяем URL
-            print(f"✅ Cloudinary загрузка успешна!")
-            print(f"   Public ID: {result.get('public_id')}")
-            print(f"   Secure URL: {cloudinary_url[:100]}...")
-            print(f"   Содержит 'res.cloudinary.com': {'✅ Да' if 'res.cloudinary.com' in cloudinary_url else '❌ Нет'}")
-            
-            # ✅ Сохраняем Cloudinary URL
-            user_data_store[user_id]["photos"].append(cloudinary_url)
-            print(f"✅ URL добавлен. Всего фото: {len(user_data_store[user_id]['photos'])}")
-            
-            # Удаляем временный файл
-            if temp_path.exists():
-                temp_path.unlink()
-            
-            await update.message.reply_text(
-                f"✅ Фото загружено в Cloudinary!\n"
-                f"📸 Загружено фото: {len(user_data_store[user_id]['photos'])}\n"
-                f"Отправьте еще фото или /done для продолжения"
-            )
-            
-            # Очищаем временную директорию если пуста
-            try:
-                if temp_dir.exists() and not any(temp_dir.iterdir()):
-                    temp_dir.rmdir()
-            except:
-                pass
-                
-            return PHOTOS
-            
-        except Exception as cloudinary_error:
-            logger.error(f"Ошибка Cloudinary: {cloudinary_error}")
-            # Удаляем временный файл
-            if temp_path.exists():
-                temp_path.unlink()
-            
-            await update.message.reply_text(
-                f"❌ Ошибка загрузки в Cloudinary: {str(cloudinary_error)[:100]}"
-            )
-            return PHOTOS
+        await update.message.reply_text(
+            f"✅ Фото принято, загружается в Cloudinary\n"
+            f"📸 Принято фото: {len(context.user_data['photos']) + len(uploads)}\n"
+            f"Отправьте еще фото или /done для продолжения"
+        )
+        return PHOTOS
             
     except Exception as e:
-        logger.error(f"Общая ошибка загрузки фото: {e}")
+        logger.error("Общая ошибка загрузки фото: %s", e)
         await update.message.reply_text("❌ Ошибка при загрузке фото. Попробуйте еще раз.")
         return PHOTOS
 
+async def _collect_uploads(user_data: dict) -> int:
+    """Дожидается фоновых загрузок пользователя; возвращает число неудачных"""
+    uploads = user_data.get("uploads") or []
+    if not uploads:
+        return 0
+    user_data["uploads"] = PendingUploads()
+    
+    failed = 0
+    results = await asyncio.gather(*uploads, return_exceptions=True)
+    for result in results:
+        if isinstance(result, BaseException):
+            failed += 1
+            logger.error("Ошибка загрузки фото: %s", result)
+        else:
+            user_data["photos"].append(result)
+    return failed
+
 async def process_done_photos(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Завершение загрузки фото"""
-    user_id = update.effective_user.id
+    failed = await _collect_uploads(context.user_data)
+    if failed:
+        await update.message.reply_text(f"⚠️ Не удалось загрузить в Cloudinary фото: {failed} шт.")
     
-    if not user_data_store[user_id].get("photos"):
+    if not context.user_data.get("photos"):
         await update.message.reply_text(
             "❌ Вы не загрузили ни одного фото!\n"
             "Пожалуйста, загрузите хотя бы одно фото:"
         )
         return PHOTOS
     
-    # ✅ ОТЛАДКА: Проверяем, какие URLs у нас есть
-    print("=" * 60)
-    print("🔍 ОТЛАДКА: Фото перед сохранением в БД:")
-    photos = user_data_store[user_id].get("photos", [])
-    for i, photo_url in enumerate(photos):
-        print(f"  Фото {i+1}: {photo_url}")
-        print(f"    Тип: {'Cloudinary' if 'cloudinary.com' in photo_url else 'Локальный'}")
-    print(f"  Всего фото: {len(photos)}")
-    print("=" * 60)
+    # ✅ ОТЛАДКА: Проверяем, какие URLs у нас есть (только при LOG_LEVEL=DEBUG)
+    if logger.isEnabledFor(logging.DEBUG):
+        photos = context.user_data.get("photos", [])
+        logger.debug("🔍 Фото перед сохранением в БД: %d шт.", len(photos))
+        for i, photo_url in enumerate(photos):
+            logger.debug("  Фото %d (%s): %s", i + 1, 'Cloudinary' if is_cloudinary_url(photo_url) else 'Локальный', photo_url)
     
     # Подтверждение данных
-    data = user_data_store[user_id]
+    data = context.user_data
     
     summary = (
         f"📋 *Проверьте данные автомобиля:*\n\n"
@@ -718,51 +837,46 @@ async def process_done_photos(update: Update, context: ContextTypes.DEFAULT_TYPE
     if data.get('description'):
         summary += f"📝 Описание: {data['description'][:100]}...\n"
     
-    keyboard = [
-        [InlineKeyboardButton("✅ Сохранить в БД", callback_data="confirm_save")],
-        [InlineKeyboardButton("❌ Отменить", callback_data="confirm_cancel")]
-    ]
-    
     await update.message.reply_text(
         summary,
-        reply_markup=InlineKeyboardMarkup(keyboard),
+        reply_markup=CONFIRM_KEYBOARD,
         parse_mode='Markdown'
     )
     return CONFIRM
 
+def _save_car(car_schema: CarCreate) -> Car:
+    with session_scope() as db:
+        # Создаем объект Car
+        db_car = Car(**car_schema.model_dump())
+        
+        db.add(db_car)
+        db.commit()
+        # refresh подтягивает id и серверные значения по умолчанию — повторный SELECT не нужен
+        db.refresh(db_car)
+        return db_car
+
 async def process_confirmation(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Обработка подтверждения"""
     query = update.callback_query
     await query.answer()
     
-    user_id = query.from_user.id
-    data = user_data_store[user_id]
+    data = context.user_data
     
     if query.data == "confirm_cancel":
         await query.edit_message_text("❌ Добавление автомобиля отменено.")
-        user_data_store.pop(user_id, None)
+        await _discard_draft(context.user_data)
         return ConversationHandler.END
     
-    # ✅ КРИТИЧЕСКАЯ ОТЛАДКА: Что реально в данных
-    print("=" * 60)
-    print("🔍 КРИТИЧЕСКАЯ ПРОВЕРКА ДАННЫХ ПЕРЕД СОХРАНЕНИЕМ:")
-    photos = data.get("photos", [])
-    print(f"   Всего фото в данных пользователя: {len(photos)}")
-    for i, url in enumerate(photos):
-        print(f"   Фото {i+1}: {url}")
-        print(f"      Тип: {'Cloudinary' if 'cloudinary.com' in url else 'Локальный'}")
-    print("=" * 60)
-    
     # Фильтруем только Cloudinary URLs
+    photos = data.get("photos", [])
     cloudinary_photos = []
     for photo_url in photos:
-        if 'res.cloudinary.com' in photo_url:
+        if is_cloudinary_url(photo_url):
             cloudinary_photos.append(photo_url)
-            print(f"✅ Cloudinary URL добавлен: {photo_url[:80]}...")
         else:
-            print(f"❌ Пропущен не-Cloudinary URL: {photo_url}")
+            logger.warning("❌ Пропущен не-Cloudinary URL: %s", photo_url)
     
-    print(f"✅ Итого Cloudinary фото: {len(cloudinary_photos)}")
+    logger.debug("✅ Cloudinary фото: %d из %d", len(cloudinary_photos), len(photos))
     
     if not cloudinary_photos:
         await query.edit_message_text("❌ Нет Cloudinary фото для сохранения!")
@@ -770,8 +884,6 @@ async def process_confirmation(update: Update, context: ContextTypes.DEFAULT_TYP
     
     # Сохранение в БД
     try:
-        db = SessionLocal()
-        
         # ✅ ВАЖНО: Проверяем данные ПЕРЕД созданием схемы
         car_data = {
             "brand": data["brand"],
@@ -787,8 +899,9 @@ async def process_confirmation(update: Update, context: ContextTypes.DEFAULT_TYP
             "doors": data["doors"],
             "seats": data["seats"],
             "color": data["color"],
-            "daily_price": data["daily_price"],
-            "deposit": data["deposit"],
+            # parse_money дает Decimal; колонки Float — приводим явно, как и в /edit_car
+            "daily_price": float(data["daily_price"]),
+            "deposit": float(data["deposit"]),
             "mileage": data["mileage"],
             "features": data.get("features", []),
             "images": cloudinary_photos,  # ✅ ТОЛЬКО Cloudinary URLs
@@ -798,76 +911,43 @@ async def process_confirmation(update: Update, context: ContextTypes.DEFAULT_TYP
             "is_active": True
         }
         
-        print(f"✅ Данные для CarCreate:")
-        print(f"   images: {car_data['images']}")
-        print(f"   thumbnail: {car_data['thumbnail']}")
+        logger.debug("Данные для CarCreate: images=%s thumbnail=%s", car_data['images'], car_data['thumbnail'])
         
-        # ✅ ОТЛАДКА: Что происходит внутри CarCreate
         try:
             car_schema = CarCreate(**car_data)
-            print(f"✅ CarCreate создана успешно")
-            print(f"   images после валидации: {car_schema.images}")
         except Exception as e:
-            print(f"❌ Ошибка в CarCreate: {e}")
+            logger.error("❌ Ошибка в CarCreate: %s", e)
             await query.edit_message_text(f"❌ Ошибка валидации: {str(e)[:200]}")
-            db.close()
             return ConversationHandler.END
         
-        # Создаем объект Car
-        db_car = Car(**car_schema.model_dump())
+        # Сессия открывается только на запись, после валидации; запись — в отдельном потоке
+        saved_car = await run_db(_save_car, car_schema)
+        invalidate_list_cars_cache()
+        logger.info("✅ Автомобиль сохранен с ID: %s, фото: %s", saved_car.id, len(saved_car.images or []))
         
-        # ✅ ОТЛАДКА: Что в объекте Car перед сохранением
-        print(f"✅ Объект Car перед сохранением:")
-        print(f"   id: будет сгенерирован")
-        print(f"   images в объекте: {db_car.images}")
-        
-        db.add(db_car)
-        db.commit()
-        db.refresh(db_car)
-        
-        # ✅ КРИТИЧЕСКАЯ ОТЛАДКА: Что реально сохранилось в БД
-        print("=" * 60)
-        print("🔍 ПРОВЕРКА СОХРАНЕННЫХ ДАННЫХ:")
-        saved_car = db.query(Car).filter(Car.id == db_car.id).first()
-        print(f"✅ Автомобиль сохранен с ID: {saved_car.id}")
-        print(f"   Сохраненные фото: {len(saved_car.images) if saved_car.images else 0}")
-        
-        if saved_car.images:
-            for i, img in enumerate(saved_car.images):
-                print(f"   Фото {i+1}: {img}")
-                print(f"      Это Cloudinary? {'✅ Да' if 'cloudinary.com' in img else '❌ НЕТ!'}")
-        
-        category = db.query(Category).filter(Category.id == db_car.category_id).first()
-        db.close()
-        
-        # Отправляем сообщение пользователю
-        if saved_car.images and 'cloudinary.com' in saved_car.images[0]:
-            await query.edit_message_text(
-                f"✅ *Автомобиль успешно добавлен!*\n\n"
-                f"🆔 ID: {saved_car.id}\n"
-                f"🚗 {saved_car.brand} {saved_car.model}\n"
-                f"📸 Фото: {len(saved_car.images)} шт. ☁️\n"
-                f"✅ Cloudinary URL сохранены правильно!",
-                parse_mode='Markdown'
-            )
+        # Отправляем сообщение пользователю: общие строки один раз, различается только статус фото
+        images = saved_car.images or []
+        is_cloud = bool(images) and is_cloudinary_url(images[0])
+        lines = [
+            "✅ *Автомобиль успешно добавлен!*" if is_cloud else "⚠️ *Автомобиль добавлен, но есть проблема!*",
+            "",
+            f"🆔 ID: {saved_car.id}",
+            f"🚗 {saved_car.brand} {saved_car.model}",
+        ]
+        if is_cloud:
+            lines.append(f"📸 Фото: {len(images)} шт. ☁️")
+            lines.append("✅ Cloudinary URL сохранены правильно!")
         else:
-            await query.edit_message_text(
-                f"⚠️ *Автомобиль добавлен, но есть проблема!*\n\n"
-                f"🆔 ID: {saved_car.id}\n"
-                f"🚗 {saved_car.brand} {saved_car.model}\n"
-                f"📸 Фото: {len(saved_car.images) if saved_car.images else 0} шт.\n"
-                f"❌ Cloudinary URLs НЕ сохранены правильно!\n"
-                f"   Первое фото: {saved_car.images[0][:50] if saved_car.images else 'Нет'}",
-                parse_mode='Markdown'
-            )
+            lines.append(f"📸 Фото: {len(images)} шт.")
+            lines.append("❌ Cloudinary URLs НЕ сохранены правильно!")
+            lines.append(f"   Первое фото: {images[0][:50] if images else 'Нет'}")
+        await query.edit_message_text("\n".join(lines), parse_mode='Markdown')
         
         # Очищаем временные данные
-        user_data_store.pop(user_id, None)
+        context.user_data.clear()
         
     except Exception as e:
-        logger.error(f"Ошибка сохранения автомобиля: {e}")
-        import traceback
-        traceback.print_exc()
+        logger.exception("Ошибка сохранения автомобиля: %s", e)
         
         await query.edit_message_text(
             f"❌ Ошибка при сохранении в БД:\n\n"
@@ -878,49 +958,165 @@ async def process_confirmation(update: Update, context: ContextTypes.DEFAULT_TYP
     return ConversationHandler.END
 
 # ========== СПИСОК АВТОМОБИЛЕЙ ==========
+# Готовый текст /list_cars: живет LIST_CARS_CACHE_TTL секунд и сбрасывается при любой записи из бота
+LIST_CARS_CACHE_TTL = float(os.getenv("BOT_LIST_CARS_CACHE_TTL", "60"))
+_list_cars_cache: Optional[Tuple[float, str]] = None
+# Поколение кэша: /list_cars выполняется параллельно с /edit_car и /delete_car (block=False),
+# поэтому текст, собранный до инвалидации, в кэш не кладем
+_list_cars_generation = 0
+
+def invalidate_list_cars_cache() -> None:
+    global _list_cars_cache, _list_cars_generation
+    _list_cars_cache = None
+    _list_cars_generation += 1
+
+# CarStatus — str-Enum: ключи совпадают и с членами Enum, и со строковыми значениями
+STATUS_ICONS = {
+    CarStatus.AVAILABLE: "✅",
+    CarStatus.UNAVAILABLE: "⛔",
+}
+
+# Только колонки, которые выводит /list_cars: легкие Row вместо ORM-объектов
+_LIST_CARS_COLUMNS = (
+    Car.id, Car.brand, Car.model, Car.year, Car.license_plate, Car.daily_price, Car.images, Car.status,
+)
+
+# Сколько машин показываем в /list_cars; остальные только считаем
+LIST_CARS_LIMIT = 10
+
+def _active_cars() -> Tuple[list, int]:
+    """Первые LIST_CARS_LIMIT активных машин и их общее число — LIMIT и COUNT считает БД"""
+    with session_scope() as db:
+        total = db.execute(select(func.count(Car.id)).where(Car.is_active == True)).scalar_one()
+        if not total:
+            return [], 0
+        rows = db.execute(
+            select(*_LIST_CARS_COLUMNS).where(Car.is_active == True).order_by(Car.id).limit(LIST_CARS_LIMIT)
+        ).all()
+        return rows, total
+
 async def list_cars(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Показать список всех машин"""
+    global _list_cars_cache
     try:
-        db = SessionLocal()
-        cars = db.query(Car).filter(Car.is_active == True).order_by(Car.id).all()
-        db.close()
+        if _list_cars_cache is not None and time.monotonic() - _list_cars_cache[0] < LIST_CARS_CACHE_TTL:
+            await update.message.reply_text(_list_cars_cache[1], parse_mode='Markdown')
+            return
+        
+        generation = _list_cars_generation
+        cars, total = await run_db(_active_cars)
         
         if not cars:
             await update.message.reply_text("🚫 В базе нет автомобилей.")
             return
         
-        message = "📋 *Список автомобилей:*\n\n"
-        for car in cars[:10]:  # Ограничиваем 10 машинами
-            # car.status — это Enum из api.models.CarStatus (значения регистрозависимы)
-            status_icons = {
-                "AVAILABLE": "✅",
-                "UNAVAILABLE": "⛔",
-            }
-            icon = status_icons.get(getattr(car.status, "value", str(car.status)), "❓")
+        parts = ["📋 *Список автомобилей:*\n\n"]
+        for car in cars:
+            icon = STATUS_ICONS.get(car.status, "❓")
             
             # Проверяем тип фото
-            photo_type = "☁️" if car.images and 'cloudinary.com' in car.images[0] else "💾" if car.images else "❌"
+            images = car.images or []
+            photo_type = ("☁️" if is_cloudinary_url(images[0]) else "💾") if images else "❌"
             
-            message += (
+            parts.append(
                 f"{icon} *ID: {car.id}*\n"
                 f"   {car.brand} {car.model} ({car.year})\n"
                 f"   Номер: {car.license_plate}\n"
                 f"   Цена: {car.daily_price} руб./день\n"
-                f"   Фото: {len(car.images)} шт. {photo_type}\n\n"
+                f"   Фото: {len(images)} шт. {photo_type}\n\n"
             )
         
-        if len(cars) > 10:
-            message += f"... и еще {len(cars) - 10} автомобилей\n"
+        if total > len(cars):
+            parts.append(f"... и еще {total - len(cars)} автомобилей\n")
         
-        message += f"Всего: *{len(cars)}* автомобилей\n"
-        message += f"☁️ = Cloudinary, 💾 = Локальные, ❌ = Нет фото"
+        parts.append(f"Всего: *{total}* автомобилей\n")
+        parts.append("☁️ = Cloudinary, 💾 = Локальные, ❌ = Нет фото")
+        message = "".join(parts)
         
+        if generation == _list_cars_generation:
+            _list_cars_cache = (time.monotonic(), message)
         await update.message.reply_text(message, parse_mode='Markdown')
     except Exception as e:
-        logger.error(f"Ошибка при получении списка автомобилей: {e}")
+        logger.error("Ошибка при получении списка автомобилей: %s", e)
         await update.message.reply_text("❌ Ошибка при загрузке списка автомобилей.")
 
 # ========== УДАЛЕНИЕ АВТОМОБИЛЯ ==========
+# delete_resources принимает до 100 public_id за запрос
+CLOUDINARY_DELETE_BATCH = 100
+
+# public_id — все после 'upload/' и необязательной версии 'v1234567890/', без расширения файла
+_CLOUDINARY_PUBLIC_ID_RE = re.compile(r"/upload/(?:v\d+/)?(.+?)(?:\.[^./]+)?$")
+
+def cloudinary_public_id(image_url: str) -> Optional[str]:
+    """public_id из URL доставки Cloudinary или None, если URL не разобрать.
+    
+    Пример URL: https://res.cloudinary.com/daxfsz15l/image/upload/v1766578214/avtorend/car_123/photo_123.jpg
+    """
+    m = _CLOUDINARY_PUBLIC_ID_RE.search(image_url)
+    return m.group(1) if m else None
+
+def _delete_resources_batch(public_ids: List[str]) -> int:
+    """Одна пачка через Admin API; возвращает число удаленных"""
+    result = cloudinary.api.delete_resources(public_ids, resource_type="image")
+    deleted = result.get("deleted", {})
+    logger.info("Удалено из Cloudinary: %s", deleted)
+    return sum(1 for pid in public_ids if deleted.get(pid) == "deleted")
+
+def _destroy_one(public_id: str) -> int:
+    result = cloudinary.uploader.destroy(public_id)
+    if result.get('result') == 'ok':
+        return 1
+    logger.warning("Не удалось удалить из Cloudinary: %s", public_id)
+    return 0
+
+async def _delete_cloudinary_images(public_ids: List[str]) -> int:
+    """Удаляет фото из Cloudinary, не блокируя event loop; возвращает число удаленных.
+    
+    SDK синхронный, поэтому каждый запрос — в своем потоке, все параллельно. Пачки, на которых
+    Admin API отказал (например, исчерпан часовой лимит), добиваем поштучными destroy через Upload API.
+    """
+    batches = [public_ids[i:i + CLOUDINARY_DELETE_BATCH] for i in range(0, len(public_ids), CLOUDINARY_DELETE_BATCH)]
+    results = await asyncio.gather(
+        *(asyncio.to_thread(_delete_resources_batch, batch) for batch in batches),
+        return_exceptions=True
+    )
+    
+    deleted_count = 0
+    leftovers = []
+    for batch, result in zip(batches, results):
+        if isinstance(result, BaseException):
+            logger.error("Ошибка удаления фото из Cloudinary: %s", result)
+            leftovers.extend(batch)
+        else:
+            deleted_count += result
+    
+    if leftovers:
+        results = await asyncio.gather(
+            *(asyncio.to_thread(_destroy_one, pid) for pid in leftovers),
+            return_exceptions=True
+        )
+        for pid, result in zip(leftovers, results):
+            if isinstance(result, BaseException):
+                logger.error("Ошибка удаления фото %s из Cloudinary: %s", pid, result)
+            else:
+                deleted_count += result
+    return deleted_count
+
+def _delete_car_row(car_id: int):
+    """DELETE ... RETURNING без загрузки ORM-объекта.
+    
+    Core DELETE обходит ORM-каскад Car.bookings, а на SQLite FK ON DELETE CASCADE
+    не работает без PRAGMA foreign_keys, поэтому брони удаляем явно в той же транзакции.
+    Возвращает Row(id, brand, model, license_plate, images) или None, если машины нет.
+    """
+    with session_scope() as db:
+        db.execute(delete(Booking).where(Booking.car_id == car_id))
+        return db.execute(
+            delete(Car)
+            .where(Car.id == car_id)
+            .returning(Car.id, Car.brand, Car.model, Car.license_plate, Car.images)
+        ).first()
+
 async def delete_car(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Удалить машину по ID и фото из Cloudinary"""
     if not context.args:
@@ -934,55 +1130,26 @@ async def delete_car(update: Update, context: ContextTypes.DEFAULT_TYPE):
         return
     
     try:
-        db = SessionLocal()
-        car = db.query(Car).filter(Car.id == car_id).first()
+        # Сначала удаляем запись из БД (в отдельном потоке), потом фото
+        car = await run_db(_delete_car_row, car_id)
+        invalidate_list_cars_cache()
         
         if not car:
-            db.close()
             await update.message.reply_text(f"❌ Автомобиль с ID {car_id} не найден")
             return
         
-        # Удаляем фото из Cloudinary (только если это Cloudinary URLs)
-        deleted_count = 0
-        cloudinary_count = 0
-        
-        for image_url in car.images:
-            if "res.cloudinary.com" in image_url:
-                cloudinary_count += 1
-                try:
-                    # Извлекаем public_id из URL
-                    # Пример URL: https://res.cloudinary.com/daxfsz15l/image/upload/v1766578214/avtorend/car_123/photo_123.jpg
-                    parts = image_url.split('/')
-                    
-                    # Ищем index после 'upload'
-                    try:
-                        upload_index = parts.index('upload')
-                        # public_id - это все после 'upload/v1234567890/'
-                        if upload_index + 2 < len(parts):
-                            public_id_parts = parts[upload_index + 2:]  # Пропускаем 'upload' и версию 'v1234567890'
-                            public_id = '/'.join(public_id_parts)
-                            # Убираем расширение файла
-                            public_id = public_id.rsplit('.', 1)[0]
-                            
-                            print(f"🔍 Удаление из Cloudinary: public_id={public_id}")
-                            
-                            # Удаляем из Cloudinary
-                            result = cloudinary.uploader.destroy(public_id)
-                            if result.get('result') == 'ok':
-                                deleted_count += 1
-                                logger.info(f"Удалено из Cloudinary: {public_id}")
-                            else:
-                                logger.warning(f"Не удалось удалить из Cloudinary: {public_id}")
-                    except ValueError:
-                        logger.warning(f"Не найден 'upload' в URL: {image_url}")
-                            
-                except Exception as e:
-                    logger.error(f"Ошибка удаления фото из Cloudinary: {e}")
+        # Удаляем фото из Cloudinary (только если это Cloudinary URLs) — пачками через Admin API
+        cloudinary_urls = [url for url in car.images or [] if is_cloudinary_url(url)]
+        cloudinary_count = len(cloudinary_urls)
+        public_ids = []
+        for image_url in cloudinary_urls:
+            public_id = cloudinary_public_id(image_url)
+            if public_id:
+                public_ids.append(public_id)
+            else:
+                logger.warning("Не найден 'upload' в URL: %s", image_url)
         
-        # Удаляем запись из БД
-        db.delete(car)
-        db.commit()
-        db.close()
+        deleted_count = await _delete_cloudinary_images(public_ids)
         
         await update.message.reply_text(
             f"✅ *Автомобиль удален*\n\n"
@@ -994,10 +1161,39 @@ async def delete_car(update: Update, context: ContextTypes.DEFAULT_TYPE):
             parse_mode='Markdown'
         )
     except Exception as e:
-        logger.error(f"Ошибка удаления автомобиля: {e}")
+        logger.error("Ошибка удаления автомобиля: %s", e)
         await update.message.reply_text(f"❌ Ошибка при удалении автомобиля: {e}")
 
 # ========== РЕДАКТИРОВАНИЕ АВТОМОБИЛЯ ==========
+_ALLOWED_STATUS = frozenset(s.value for s in CarStatus)
+_ALLOWED_STATUS_TEXT = ", ".join(sorted(_ALLOWED_STATUS))
+
+def _parse_status(text: str) -> CarStatus:
+    """Статус в любом регистре: available/AVAILABLE"""
+    normalized = text.strip().upper()
+    if normalized not in _ALLOWED_STATUS:
+        raise ValueError(f"допустимые статусы: {_ALLOWED_STATUS_TEXT}")
+    return CarStatus(normalized)
+
+# Поле -> функция разбора значения; добавить поле в /edit_car = добавить строку сюда
+_EDITABLE = {
+    "daily_price": lambda v: float(parse_money(v)),
+    "deposit": lambda v: float(parse_money(v)),
+    "mileage": int,
+    "status": _parse_status,
+    "description": str,
+}
+
+def _update_car_field(car_id: int, field: str, new_value) -> Tuple[Optional[Car], object]:
+    """Меняет одно поле машины; возвращает (car, старое значение) или (None, None)"""
+    with session_scope() as db:
+        car = db.query(Car).filter(Car.id == car_id).first()
+        if not car:
+            return None, None
+        old_value = getattr(car, field, None)
+        setattr(car, field, new_value)
+        return car, old_value
+
 async def edit_car(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Редактировать машину по ID"""
     if not context.args:
@@ -1006,7 +1202,7 @@ async def edit_car(update: Update, context: ContextTypes.DEFAULT_TYPE):
             "*Доступные поля:*\n"
             "• `daily_price` - цена за день\n"
             "• `deposit` - залог\n" 
-            "• `status` - статус (AVAILABLE, UNAVAILABLE)\n"
+            f"• `status` - статус ({_ALLOWED_STATUS_TEXT})\n"
             "• `mileage` - пробег\n"
             "• `description` - описание\n\n"
             "*Пример:*\n"
@@ -1033,45 +1229,22 @@ async def edit_car(update: Update, context: ContextTypes.DEFAULT_TYPE):
         return
     
     try:
-        db = SessionLocal()
-        car = db.query(Car).filter(Car.id == car_id).first()
-        
-        if not car:
-            db.close()
-            await update.message.reply_text(f"❌ Автомобиль с ID {car_id} не найден")
-            return
-        
-        old_value = getattr(car, field, None)
-        
-        # Обновляем поле
-        if field == "daily_price":
-            car.daily_price = float(value)
-        elif field == "deposit":
-            car.deposit = float(value)
-        elif field == "mileage":
-            car.mileage = int(value)
-        elif field == "status":
-            # Разрешаем вводить статус в любом регистре: available/AVAILABLE
-            normalized = value.strip().upper()
-            allowed = [s.value for s in CarStatus]
-            if normalized in allowed:
-                car.status = CarStatus(normalized)
-            else:
-                await update.message.reply_text(
-                    f"❌ Неверный статус. Допустимые: {', '.join(allowed)}"
-                )
-                db.close()
-                return
-        elif field == "description":
-            car.description = value
-        else:
+        # Разбираем значение до открытия сессии
+        caster = _EDITABLE.get(field)
+        if caster is None:
             await update.message.reply_text(
                 f"❌ Поле '{field}' недоступно для редактирования"
             )
-            db.close()
+            return
+        new_value = caster(value)
+        
+        car, old_value = await run_db(_update_car_field, car_id, field, new_value)
+        invalidate_list_cars_cache()
+        
+        if not car:
+            await update.message.reply_text(f"❌ Автомобиль с ID {car_id} не найден")
             return
         
-        db.commit()
         await update.message.reply_text(
             f"✅ *Автомобиль обновлен*\n\n"
             f"🆔 ID: {car_id}\n"
@@ -1085,26 +1258,19 @@ async def edit_car(update: Update, context: ContextTypes.DEFAULT_TYPE):
     except ValueError as e:
         await update.message.reply_text(f"❌ Неверное значение для поля {field}: {e}")
     except Exception as e:
-        logger.error(f"Ошибка редактирования автомобиля: {e}")
+        logger.error("Ошибка редактирования автомобиля: %s", e)
         await update.message.reply_text(f"❌ Ошибка при редактировании: {e}")
-    finally:
-        try:
-            db.close()
-        except:
-            pass
 
 # ========== ВСПОМОГАТЕЛЬНЫЕ ФУНКЦИИ ==========
 async def cancel(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Отмена текущей операции"""
-    user_id = update.effective_user.id
-    if user_id in user_data_store:
-        user_data_store.pop(user_id, None)
+    await _discard_draft(context.user_data)
     await update.message.reply_text("Операция отменена.")
     return ConversationHandler.END
 
 async def error_handler(update: object, context: ContextTypes.DEFAULT_TYPE):
     """Обработчик ошибок"""
-    logger.error(f"Update вызвал ошибку: {context.error}")
+    logger.error("Update вызвал ошибку: %s", context.error)
     if update and hasattr(update, 'message') and update.message:
         await update.message.reply_text("❌ Произошла ошибка. Попробуйте еще раз.")
 
@@ -1112,25 +1278,38 @@ async def error_handler(update: object, context: ContextTypes.DEFAULT_TYPE):
 def start_bot():
     """Запуск бота - вызывается из bot_runner.py"""
     
-    print("\n" + "=" * 60)
-    print("🚀 ЗАПУСК ТЕЛЕГРАМ БОТА (PRODUCTION)")
-    print("=" * 60)
-    print(f"☁️  Cloudinary: {CLOUDINARY_CLOUD_NAME}")
-    print(f"🔐 Хранилище: ТОЛЬКО CLOUDINARY")
-    print("=" * 60)
+    logger.info("🚀 ЗАПУСК ТЕЛЕГРАМ БОТА (PRODUCTION), Cloudinary: %s, хранилище: ТОЛЬКО CLOUDINARY", CLOUDINARY_CLOUD_NAME)
     
     try:
         # Создаем приложение
-        application = Application.builder().token(TOKEN).build()
+        # AIORateLimiter держит глобальный лимит Telegram (TELEGRAM_MAX_RATE/с) и сам повторяет запросы после 429
+        # HTTP/2 к api.telegram.org: параллельные sendMessage мультиплексируются в одном TLS-соединении.
+        # Для getUpdates — отдельный клиент, чтобы long polling не занимал пул исходящих запросов
+        application = (
+            Application.builder()
+            .token(TOKEN)
+            .persistence(PicklePersistence(
+                filepath=BOT_STATE_FILE,
+                store_data=PersistenceInput(bot_data=False, chat_data=False, callback_data=False),
+            ))
+            .request(HTTPXRequest(connection_pool_size=32, http_version="2", read_timeout=30))
+            .get_updates_request(HTTPXRequest(http_version="2", read_timeout=30))
+            .rate_limiter(AIORateLimiter(overall_max_rate=TELEGRAM_MAX_RATE, overall_time_period=1, max_retries=3))
+            .post_init(_verify_cloudinary)
+            .post_shutdown(_close_cloudinary_http)
+            .build()
+        )
         
         # 1. РЕГИСТРИРУЕМ ОБЫЧНЫЕ КОМАНДЫ ПЕРВЫМИ
+        # Команды с запросами к БД — block=False: выполняются параллельно и не держат очередь апдейтов.
+        # concurrent_updates не включаем: ConversationHandler (/add_car) требует последовательной обработки
         application.add_handler(CommandHandler("debug", debug))
         application.add_handler(CommandHandler("start", start))
-        application.add_handler(CommandHandler("status", admin_status))
-        application.add_handler(CommandHandler("list_cars", list_cars))
-        application.add_handler(CommandHandler("delete_car", delete_car))
-        application.add_handler(CommandHandler("edit_car", edit_car))
-        application.add_handler(CommandHandler("check_photos", check_photos))
+        application.add_handler(CommandHandler("status", admin_status, block=False))
+        application.add_handler(CommandHandler("list_cars", list_cars, block=False))
+        application.add_handler(CommandHandler("delete_car", delete_car, block=False))
+        application.add_handler(CommandHandler("edit_car", edit_car, block=False))
+        application.add_handler(CommandHandler("check_photos", check_photos, block=False))
         application.add_handler(CommandHandler("cancel", cancel))
         
         # 2. ПОТОМ ConversationHandler (важно - ПОСЛЕ обычных команд!)
@@ -1162,7 +1341,10 @@ def start_bot():
                 CONFIRM: [CallbackQueryHandler(process_confirmation, pattern="^confirm_")]
             },
             fallbacks=[CommandHandler("cancel", cancel)],
-            per_message=False
+            per_message=False,
+            # Шаг диалога хранится в PicklePersistence — после рестарта админ продолжает с того же места
+            name="add_car_conv",
+            persistent=True
         )
         
         application.add_handler(conv_handler)
@@ -1170,20 +1352,11 @@ def start_bot():
         # Обработчик ошибок
         application.add_error_handler(error_handler)
         
-        print("✅ Приложение создано")
-        print("✅ Зарегистрированы команды:")
-        print("   • /debug - отладка")
-        print("   • /start - начало работы")
-        print("   • /status - статус системы")
-        print("   • /list_cars - список авто")
-        print("   • /delete_car <id> - удалить авто")
-        print("   • /edit_car <id> <поле> <значение> - редактировать")
-        print("   • /check_photos - проверить фото в БД")
-        print("   • /add_car - добавить авто")
-        print("   • /cancel - отмена")
-        print("\n🔄 Запуск polling...")
-        print("📱 Отправьте /debug боту для проверки")
-        print("=" * 60 + "\n")
+        logger.info(
+            "✅ Приложение создано, команды: /debug, /start, /status, /list_cars, /delete_car, "
+            "/edit_car, /check_photos, /add_car, /cancel"
+        )
+        logger.info("🔄 Запуск polling... Отправьте /debug боту для проверки")
         
         # Запускаем бота
         application.run_polling(
@@ -1192,13 +1365,10 @@ def start_bot():
         )
         
     except Exception as e:
-        logger.error(f"❌ Ошибка запуска бота: {e}")
-        print(f"\n❌ КРИТИЧЕСКАЯ ОШИБКА:")
-        import traceback
-        traceback.print_exc()
+        logger.exception("❌ Ошибка запуска бота: %s", e)
         sys.exit(1)
 
 # ========== ТОЧКА ВХОДА ==========
 if __name__ == "__main__":
-    print("🔧 Прямой запуск бота (production)...")
+    logger.info("🔧 Прямой запуск бота (production)...")
     start_bot()